@@ -3,19 +3,14 @@ import streamlit as st
 import pandas as pd
 import altair as alt
 from datetime import date
-import datetime as dt
 from sqlalchemy import text
 
 from lib.auth import require_login, user_role, logout_button
-from lib.db import ensure_schema, seed_if_empty, db, engine
-from lib.payroll import run_payroll
-from lib.ui import inject_theme_css, top_nav, stat_card, chart_card, get_theme
-from lib.pdf_ingest import parse_payslip, parse_consolidated
-from lib.storage import put_bytes, presigned_url
-try:
-    from lib.matching import match_consolidated_names
-except Exception:
-    match_consolidated_names = None
+from lib.db import bootstrap, db, engine, insert_returning_id
+from lib.cache import read_df, read_scalar, touch, cache_stats
+from lib.ui import inject_theme_css, top_nav, stat_card, chart_card, get_theme, job_panel
+# Page-specific modules (reportlab, pdfplumber, boto3 behind them) are imported
+# inside their page branch so cold start and other pages don't pay for them.
 
 st.set_page_config(page_title="INET HRMS", page_icon="🧩", layout="wide")
 
@@ -24,8 +19,7 @@ if "theme" not in st.session_state:
 
 inject_theme_css(get_theme())
 
-ensure_schema()
-seed_if_empty()
+bootstrap()  # schema + seed, once per server process
 
 require_login()
 
@@ -39,26 +33,23 @@ logout_button("Logout")
 # ---------------- Dashboard ----------------
 if page_key == "dashboard":
     st.title("INET HRMS — Overview")
-    with db() as conn:
-        headcount_sql = "SELECT COUNT(*) FROM employees WHERE active=1" if engine.dialect.name=="sqlite" else "SELECT COUNT(*) FROM employees WHERE active=TRUE"
-        headcount = conn.exec_driver_sql(headcount_sql).scalar()
-        total_net = float(conn.exec_driver_sql("SELECT COALESCE(SUM(net),0) FROM payslips").scalar() or 0)
-        att_df = pd.read_sql(
-            "SELECT day AS d, COUNT(*) AS punches FROM attendance_logs GROUP BY day ORDER BY day DESC LIMIT 30",
-            conn.connection,
-        ).sort_values("d")
-        wvd = pd.read_sql(
-            """
-            SELECT pr.year, pr.month, SUM(p.gross) AS gross, SUM(p.deductions) AS deductions, SUM(p.net) AS net
-            FROM payslips p
-            JOIN payroll_runs pr ON pr.id = p.run_id
-            GROUP BY pr.year, pr.month
-            ORDER BY pr.year, pr.month
-            """,
-            conn.connection,
-        )
-        if not wvd.empty:
-            wvd["period"] = wvd["year"].astype(str) + "-" + wvd["month"].astype(int).astype(str).str.zfill(2)
+    # cached reads (lib/cache.py); dropped when the import/payroll write paths touch these tables
+    headcount_sql = "SELECT COUNT(*) FROM employees WHERE active=1" if engine.dialect.name=="sqlite" else "SELECT COUNT(*) FROM employees WHERE active=TRUE"
+    headcount = read_scalar(engine, headcount_sql, tables=["employees"])
+    # dashboard reads the pre-aggregated rollups (lib/rollups.py), not the base tables
+    total_net = float(read_scalar(engine, "SELECT COALESCE(SUM(net),0) FROM payroll_monthly", tables=["payroll_monthly"]) or 0)
+    # SQLite keeps day as INTEGER days since 1970-01-01 (migration 3)
+    day_col = "date(day * 86400, 'unixepoch')" if engine.dialect.name=="sqlite" else "day"
+    att_df = read_df(
+        engine, f"SELECT {day_col} AS d, punches FROM attendance_daily ORDER BY day DESC LIMIT 30",
+        tables=["attendance_daily"],
+    ).sort_values("d")
+    wvd = read_df(
+        engine, "SELECT year, month, gross, deductions, net FROM payroll_monthly ORDER BY year, month",
+        tables=["payroll_monthly"],
+    )
+    if not wvd.empty:
+        wvd["period"] = wvd["year"].astype(str) + "-" + wvd["month"].astype(int).astype(str).str.zfill(2)
 
     c1, c2, c3 = st.columns(3)
     with c1: stat_card("Headcount", f"{headcount}")
@@ -87,6 +78,7 @@ if page_key == "dashboard":
 
 # ---------------- Attendance ----------------
 elif page_key == "attendance":
+    from lib.jobs import spool, submit
     st.title("Attendance Import (CSV)")
     st.write("CSV header: **code, day, punch_in, punch_out, source**")
 
@@ -99,83 +91,93 @@ elif page_key == "attendance":
     auto_create = st.checkbox("Create missing employees automatically", value=True)
 
     if att_file:
-        df = pd.read_csv(att_file, dtype={"code": str})
-        st.dataframe(df.head(), use_container_width=True)
+        st.dataframe(pd.read_csv(att_file, dtype={"code": str}, nrows=5), use_container_width=True)
+        att_file.seek(0)
 
         code_to_name = {}
         if map_file:
-            map_df = pd.read_csv(map_file, dtype={"code": str})
-            for _, r in map_df.iterrows():
-                c = str(r.get("code", "")).strip()
-                n = str(r.get("name", "")).strip()
-                if c:
-                    code_to_name[c] = n
+            map_df = pd.read_csv(map_file, dtype={"code": str, "name": str}).fillna("")
+            code_to_name = dict(zip(map_df["code"].str.strip(), map_df["name"].str.strip()))
+            code_to_name.pop("", None)
 
-        created, inserted = 0, 0
-        with db() as conn:
-            emp_df = pd.read_sql("SELECT id, code, first_name, last_name FROM employees", conn.connection)
-            id_by_code = {str(r["code"]).strip(): int(r["id"]) for _, r in emp_df.iterrows()}
+        # runs as a background job: survives reconnects and doesn't block this session
+        if st.button("Import attendance", type="primary"):
+            job_id = submit(engine, "attendance", {
+                "path": spool(att_file.getvalue(), ".csv"),
+                "code_to_name": code_to_name, "auto_create": auto_create,
+            })
+            st.success(f"Queued attendance import as job {job_id}.")
 
-            csv_codes = {str(c).strip() for c in df["code"].tolist()}
-            missing = sorted(csv_codes - set(id_by_code.keys()))
+    st.subheader("Import jobs")
+    job_panel(engine, ["attendance"], key="att_jobs")
 
-            if missing and auto_create:
-                for code in missing:
-                    fname = ""; lname = ""
-                    if code in code_to_name and code_to_name[code]:
-                        parts = [p for p in code_to_name[code].replace(".", "").split() if p]
-                        if parts:
-                            fname = parts[0]; lname = " ".join(parts[1:])
-                    conn.exec_driver_sql(
-                        "INSERT INTO employees(code, first_name, last_name, base_salary, active) VALUES (?,?,?,?,?)"
-                        if engine.dialect.name=="sqlite" else
-                        "INSERT INTO employees(code, first_name, last_name, base_salary, active) VALUES (%s,%s,%s,%s,%s)",
-                        (code, fname, lname, 0, 1),
-                    )
-                    created += 1
-                emp_df = pd.read_sql("SELECT id, code FROM employees", conn.connection)
-                id_by_code = {str(r["code"]).strip(): int(r["id"]) for _, r in emp_df.iterrows()}
-
-            pmark = "?" if engine.dialect.name=="sqlite" else "%s"
-            for _, row in df.iterrows():
-                code = str(row["code"]).strip()
-                emp_id = id_by_code.get(code)
-                if not emp_id:
-                    continue
-                conn.exec_driver_sql(
-                    f"INSERT INTO attendance_logs(employee_id, day, punch_in, punch_out, source) VALUES ({pmark},{pmark},{pmark},{pmark},{pmark})",
-                    (emp_id, str(row["day"]), str(row["punch_in"]), str(row["punch_out"]), str(row.get("source","csv"))),
-                )
-                inserted += 1
-
-        if created:  st.success(f"Created {created} missing employee(s).")
-        if inserted: st.success(f"Imported {inserted} attendance row(s).")
-        if not inserted:
-            if not auto_create and missing:
-                st.warning(f"No rows imported. {len(missing)} code(s) not found. Upload a mapping CSV or enable 'Create missing employees'.")
-            else:
-                st.warning("No rows imported. Check that CSV 'code' values match employee codes.")
+    # rows the typed-attendance migration could not convert are kept, not dropped
+    n_rejects = read_scalar(engine, "SELECT COUNT(*) FROM attendance_rejects", tables=["attendance_rejects"])
+    if n_rejects:
+        with st.expander(f"{n_rejects:,} older attendance rows could not be converted and are kept here"):
+            rejects = read_df(engine, "SELECT * FROM attendance_rejects ORDER BY id", tables=["attendance_rejects"])
+            st.dataframe(rejects, use_container_width=True)
+            st.download_button("Download rejected rows", rejects.to_csv(index=False).encode(),
+                               "attendance_rejects.csv", "text/csv")
 
 # ---------------- Payroll ----------------
 elif page_key == "payroll":
+    from lib.jobs import submit
+    from lib.storage import object_urls
     st.title("Payroll")
     col1, col2 = st.columns(2)
     month = col1.selectbox("Month", list(range(1, 13)), index=date.today().month - 1)
     year = col2.number_input("Year", min_value=2000, max_value=2100, value=date.today().year, step=1)
+    merged = st.checkbox("Single merged run document (one PDF for print/archive)", value=False)
+    # queued as a background job; several months can be queued and the page stays usable
     if st.button("Process Payroll Run", use_container_width=True, type="primary"):
-        results = run_payroll(engine, int(month), int(year))
-        st.success(f"Processed {len(results)} employees")
-        st.dataframe(pd.DataFrame(results), use_container_width=True)
+        job_id = submit(engine, "payroll", {"month": int(month), "year": int(year), "merged": merged})
+        st.success(f"Queued payroll {int(month):02d}/{int(year)} as job {job_id}.")
+
+    st.subheader("Payroll jobs")
+    job_panel(engine, ["payroll"], key="payroll_jobs")
+
+    st.subheader("Payslips")
+    runs = read_df(engine, "SELECT id, month, year, status FROM payroll_runs ORDER BY year DESC, month DESC, id DESC",
+                   tables=["payroll_runs"])
+    if runs.empty:
+        st.info("No payroll runs yet.")
+    else:
+        run_label = runs.apply(lambda r: f"{int(r['month']):02d}/{int(r['year'])} · run {int(r['id'])} ({r['status']})", axis=1)
+        pick = st.selectbox("Run", runs.index, format_func=lambda i: run_label[i], key="view_run")
+        pmark = "?" if engine.dialect.name=="sqlite" else "%s"
+        slips = read_df(
+            engine,
+            f"""
+            SELECT e.code, e.first_name, e.last_name, p.gross, p.deductions, p.net, p.url
+            FROM payslips p JOIN employees e ON e.id = p.employee_id
+            WHERE p.run_id = {pmark} ORDER BY e.code
+            """,
+            tables=["payslips", "employees"], params=(int(runs.loc[pick, "id"]),),
+        )
+        # sign links only now, in one batch (cached for repeat views)
+        slips["url"] = object_urls(slips["url"])
+        st.dataframe(slips, use_container_width=True,
+                     column_config={"url": st.column_config.LinkColumn("Payslip")})
 
 # ---------------- Docs ----------------
 elif page_key == "docs":
+    # cached by file hash: reruns while a file stays uploaded don't re-run pdfplumber
+    from lib.pdf_ingest import parse_payslip_cached as parse_payslip, parse_consolidated_cached as parse_consolidated
+    from lib.storage import put_deduped
+    from lib.payroll import upsert_payslips
+    from lib.payslip_batch import resolve_runs
+    try:
+        from lib.matching import match_consolidated_names, corrected_aliases, save_aliases
+    except Exception:
+        match_consolidated_names = None
     st.title("Payroll Documents")
-    tab1, tab2 = st.tabs(["Single Pay Slip", "Consolidated Statement"])
+    tab1, tab2, tab3 = st.tabs(["Single Pay Slip", "Consolidated Statement", "Batch Pay Slips"])
 
     with tab1:
         f = st.file_uploader("Upload Pay Slip (PDF)", type=["pdf"], key="pslip")
         if f:
-            data = f.read()
+            data = f.getvalue()
             parsed = parse_payslip(data)
             colA, colB = st.columns(2)
             with colA:
@@ -201,116 +203,126 @@ elif page_key == "docs":
                     if row: emp_id = row[0]
                     else:
                         code = "E" + str(abs(hash(emp_name)) % 10_000)
-                        conn.exec_driver_sql(
-                            "INSERT INTO employees(code, first_name, last_name, base_salary, active) VALUES (?,?,?,?,?)"
-                            if engine.dialect.name=="sqlite" else
-                            "INSERT INTO employees(code, first_name, last_name, base_salary, active) VALUES (%s,%s,%s,%s,%s)",
-                            (code, fname, lname, parsed.get("gross") or 0, 1)
-                        )
-                        emp_id = conn.exec_driver_sql(
-                            "SELECT last_insert_rowid()" if engine.dialect.name=="sqlite" else "SELECT max(id) FROM employees"
-                        ).scalar()
-                    run = conn.exec_driver_sql(
-                        "SELECT id FROM payroll_runs WHERE month=? AND year=?"
-                        if engine.dialect.name=="sqlite" else
-                        "SELECT id FROM payroll_runs WHERE month=%s AND year=%s",
-                        (month_, year_)
-                    ).fetchone()
-                    if run: run_id = run[0]
-                    else:
-                        conn.exec_driver_sql(
-                            "INSERT INTO payroll_runs(month,year,status,processed_on) VALUES (?,?,?,?)"
-                            if engine.dialect.name=="sqlite" else
-                            "INSERT INTO payroll_runs(month,year,status,processed_on) VALUES (%s,%s,%s,%s)",
-                            (month_, year_, "Imported", dt.datetime.utcnow())
-                        )
-                        run_id = conn.exec_driver_sql(
-                            "SELECT last_insert_rowid()" if engine.dialect.name=="sqlite" else "SELECT max(id) FROM payroll_runs"
-                        ).scalar()
-                    key = f"uploads/{year_}/{month_:02d}/payslip_{emp_id}.pdf"
-                    put_bytes(key, data)
-                    url = presigned_url(key) or key
-                    conn.exec_driver_sql(
-                        "INSERT INTO payslips(run_id, employee_id, gross, deductions, net, url) VALUES (?,?,?,?,?,?)"
-                        if engine.dialect.name=="sqlite" else
-                        "INSERT INTO payslips(run_id, employee_id, gross, deductions, net, url) VALUES (%s,%s,%s,%s,%s,%s)",
-                        (run_id, emp_id, parsed.get("gross") or 0,
-                         (parsed.get("gross") or 0) - (parsed.get("net") or 0),
-                         parsed.get("net") or 0, url)
-                    )
-                st.success("Saved payslip & uploaded PDF")
+                        emp_id = insert_returning_id(conn, "employees",
+                                                     ("code", "first_name", "last_name", "base_salary", "active"),
+                                                     (code, fname, lname, parsed.get("gross") or 0, 1))
+                    run_id = resolve_runs(conn, [(month_, year_)])[(month_, year_)]
+                # upload outside the transaction above; dedupe skips bytes already stored
+                [key], [reused] = put_deduped(engine, [(f"uploads/{year_}/{month_:02d}/payslip_{emp_id}.pdf", data)])
+                with db() as conn:
+                    gross_, net_ = parsed.get("gross") or 0, parsed.get("net") or 0
+                    inserted, updated = upsert_payslips(conn, run_id, year_, month_,
+                                                        [(emp_id, gross_, gross_ - net_, net_, key)])
+                    touch(conn, "employees", "payroll_runs", "payslips", "payroll_monthly")
+                st.success(("Saved payslip" if inserted else "Updated existing payslip" if updated else "Payslip already up to date")
+                           + (" (identical PDF already stored, upload skipped)" if reused else " & uploaded PDF"))
 
     with tab2:
         f2 = st.file_uploader("Upload Consolidated Statement (PDF)", type=["pdf"], key="consol")
         if f2:
-            df = parse_consolidated(f2.read())
-            st.dataframe(df, use_container_width=True)
+            # first parse streams page by page: show rows as they arrive; cache hits return at once
+            bar, table, seen = st.empty(), st.empty(), []
+            def _on_chunk(rows):
+                if sum(map(len, seen)) < 500:  # a preview of the first rows is enough mid-parse
+                    seen.append(rows)
+                    table.dataframe(pd.concat(seen, ignore_index=True), use_container_width=True)
+            df = parse_consolidated(
+                f2.getvalue(), on_chunk=_on_chunk,
+                progress=lambda page, pages, rows: bar.progress(page / pages, text=f"Page {page}/{pages} · {rows} rows"),
+            )
+            bar.empty()
+            table.dataframe(df, use_container_width=True)
             c1, c2 = st.columns(2)
             sel_month = c1.selectbox("Payroll month", list(range(1, 13)), index=date.today().month - 1, key="consol_m")
             sel_year  = c2.number_input("Payroll year", min_value=2000, max_value=2100, value=date.today().year, step=1, key="consol_y")
             if match_consolidated_names is None:
                 st.info("Name matching helper not found (lib/matching.py). Add it to enable preview & matching.")
             else:
+                def _match():
+                    # learned aliases (name_aliases) resolve first, then exact/fuzzy
+                    emp_df = read_df(engine, "SELECT id, code, first_name, last_name FROM employees", tables=["employees"])
+                    al = read_df(engine, "SELECT alias, employee_id FROM name_aliases", tables=["name_aliases"])
+                    return emp_df, match_consolidated_names(df, emp_df, threshold=0.86,
+                                                            aliases=dict(zip(al["alias"], al["employee_id"])))
                 if st.button("Preview & Match names", type="primary"):
-                    with db() as conn:
-                        emp_df = pd.read_sql("SELECT id, code, first_name, last_name FROM employees", conn.connection)
-                    matched = match_consolidated_names(df, emp_df, threshold=0.86)
-                    st.session_state["consol_matched"] = matched
+                    st.session_state["consol_matched"] = _match()[1]
                     st.session_state["consol_month"] = int(sel_month)
                     st.session_state["consol_year"] = int(sel_year)
                 if "consol_matched" in st.session_state:
                     matched = st.session_state["consol_matched"]
                     st.subheader("Match preview")
+                    if "consol_flash" in st.session_state:
+                        saved, problems = st.session_state.pop("consol_flash")
+                        st.success(f"Saved {saved} aliases and re-matched.")
+                        for msg in problems[:20]:
+                            st.error(msg)
+                    st.caption(" · ".join(f"{k}: {v}" for k, v in matched["match_type"].value_counts().items()))
                     st.dataframe(matched, use_container_width=True)
                     um = matched[matched["match_type"] == "unmatched"]
                     if not um.empty:
-                        st.warning(f"{len(um)} names were not matched. You can download and correct them.")
+                        st.warning(f"{len(um)} names were not matched. Download them, fill in emp_id (or add a code column) and upload the file back.")
                         st.download_button("Download unmatched (CSV)", um.to_csv(index=False).encode(), "unmatched_names.csv", "text/csv")
+                        fix = st.file_uploader("Upload corrected unmatched (CSV)", type=["csv"], key="consol_fix")
+                        if fix and st.button("Save corrections as aliases"):
+                            emp_df = read_df(engine, "SELECT id, code, first_name, last_name FROM employees", tables=["employees"])
+                            pairs, problems = corrected_aliases(pd.read_csv(fix, dtype={"code": "string"}), emp_df)
+                            with db() as conn:
+                                saved = save_aliases(conn, pairs, source="manual")
+                                touch(conn, "name_aliases")
+                            st.session_state["consol_matched"] = _match()[1]
+                            st.session_state["consol_flash"] = (saved, problems)
+                            st.rerun()
                     else:
                         st.success("All names matched.")
                     if st.button("Write matched to payslips"):
                         month_ = st.session_state["consol_month"]
                         year_  = st.session_state["consol_year"]
                         to_write = matched[matched["emp_id"].notna()].copy()
-                        inserted = 0
                         with db() as conn:
-                            run = conn.exec_driver_sql(
-                                "SELECT id FROM payroll_runs WHERE month=? AND year=?"
-                                if engine.dialect.name=="sqlite" else
-                                "SELECT id FROM payroll_runs WHERE month=%s AND year=%s",
-                                (month_, year_)
-                            ).fetchone()
-                            if run: run_id = run[0]
-                            else:
-                                conn.exec_driver_sql(
-                                    "INSERT INTO payroll_runs(month,year,status,processed_on) VALUES (?,?,?,?)"
-                                    if engine.dialect.name=="sqlite" else
-                                    "INSERT INTO payroll_runs(month,year,status,processed_on) VALUES (%s,%s,%s,%s)",
-                                    (month_, year_, "Imported", dt.datetime.utcnow())
-                                )
-                                run_id = conn.exec_driver_sql(
-                                    "SELECT last_insert_rowid()" if engine.dialect.name=="sqlite" else "SELECT max(id) FROM payroll_runs"
-                                ).scalar()
-                            pmark = "?" if engine.dialect.name=="sqlite" else "%s"
-                            for _, r in to_write.iterrows():
-                                emp_id = int(r["emp_id"]); net = float(r["net"] or 0.0)
-                                gross = net; ded = 0.0
-                                conn.exec_driver_sql(
-                                    f"INSERT INTO payslips(run_id, employee_id, gross, deductions, net, url) VALUES ({pmark},{pmark},{pmark},{pmark},{pmark},{pmark})",
-                                    (run_id, emp_id, gross, ded, net, None)
-                                )
-                                inserted += 1
-                        st.success(f"Wrote {inserted} payslips to run {month_:02d}/{year_}.")
+                            run_id = resolve_runs(conn, [(month_, year_)])[(month_, year_)]
+                            # one bulk upsert on (run_id, employee_id): re-writing the same statement is a no-op
+                            net_ = to_write["net"].fillna(0.0).astype(float)
+                            inserted, updated = upsert_payslips(
+                                conn, run_id, year_, month_,
+                                zip(to_write["emp_id"].astype(int), net_, [0.0] * len(to_write), net_, [None] * len(to_write)),
+                            )
+                            # writing is the confirmation: remember fuzzy matches for next month
+                            fz = to_write[to_write["match_type"] == "fuzzy"]
+                            save_aliases(conn, zip(fz["name"], fz["emp_id"]), source="confirmed")
+                            touch(conn, "payroll_runs", "payslips", "payroll_monthly", "name_aliases")
+                        st.success(f"Run {month_:02d}/{year_}: {inserted} payslips inserted, {updated} updated.")
         if "df" in locals():
             st.download_button("Download as CSV", df.to_csv(index=False).encode(), "consolidated.csv", "text/csv")
 
+    with tab3:
+        from lib.payslip_batch import ingest_payslips
+        batch = st.file_uploader("Upload pay slips (PDFs or a .zip of PDFs)", type=["pdf", "zip"],
+                                 accept_multiple_files=True, key="pslip_batch")
+        if batch and st.button("Ingest batch", type="primary"):
+            bar = st.progress(0.0, text="Parsing…")
+            report, stats = ingest_payslips(
+                engine, [(u.name, u.getvalue()) for u in batch],
+                progress=lambda done, total: bar.progress(done / max(total, 1), text=f"Parsed {done}/{total}"),
+            )
+            bar.empty()
+            (st.success if not stats["failed"] else st.warning)(
+                f"Saved {stats['saved']} of {stats['files']} files ({stats['inserted']} new, {stats['updated']} updated payslips) · "
+                f"{stats['failed']} failed · "
+                f"{stats['created']} new employees · {stats['files_per_sec']} files/sec ({stats['seconds']} s)"
+            )
+            st.dataframe(report, use_container_width=True)
+            st.download_button("Download report (CSV)", report.to_csv(index=False).encode(),
+                               "payslip_batch_report.csv", "text/csv")
+
 # ---------------- Employees ----------------
 elif page_key == "employees":
     st.title("Employees")
-    df = pd.read_sql("SELECT id, code, first_name, last_name, base_salary, active FROM employees", con=engine)
+    df = read_df(engine, "SELECT id, code, first_name, last_name, base_salary, active FROM employees", tables=["employees"])
     st.dataframe(df, use_container_width=True)
 
 # ---------------- Reports ----------------
 elif page_key == "reports":
     st.title("Reports")
     st.info("Add attendance trends, compliance, embeds, etc.")
+    st.caption("Query cache")
+    st.dataframe(pd.DataFrame([cache_stats()]), use_container_width=True)
@@ -0,0 +1,108 @@
+# bench/concurrency.py
+"""
+Reader latency on the SQLite fallback while a bulk write transaction is open
+(the shape of a payroll checkpoint or an attendance import chunk), with the
+old engine settings (rollback journal, pysqlite defaults) vs lib.db's
+SQLITE_PRAGMAS (WAL, synchronous=NORMAL, mmap, bigger page cache).
+Readers run dashboard-style queries on their own connections; "locked"
+counts queries that failed with "database is locked". With WAL the write
+itself takes longer only because readers keep running alongside it (same
+process, shared GIL) instead of queueing behind the lock.
+Run from the repo root:  python -m bench.concurrency [n_readers] [write_rows]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+from sqlalchemy.exc import OperationalError
+
+from lib.db import SQLITE_PRAGMAS, make_engine
+from lib.migrations import migrate
+
+N_EMP = 2000
+THINK = 0.01  # pause between a reader's queries, like a user clicking around
+READS = [
+    "SELECT COUNT(*) FROM employees WHERE active=1",
+    "SELECT run_id, SUM(net) FROM payslips GROUP BY run_id",
+    "SELECT day, COUNT(*) FROM attendance_logs GROUP BY day ORDER BY day DESC LIMIT 30",
+]
+
+def _populate(engine):
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "INSERT INTO employees(code, first_name, last_name, base_salary) VALUES (?,?,?,?)",
+            [(f"E{i:05d}", "F", "L", 20000) for i in range(1, N_EMP + 1)],
+        )
+        run = conn.exec_driver_sql(
+            "INSERT INTO payroll_runs(month, year, status) VALUES (1, 2025, 'Completed') RETURNING id").scalar()
+        conn.exec_driver_sql(
+            "INSERT INTO payslips(run_id, employee_id, gross, deductions, net) VALUES (?,?,?,?,?)",
+            [(run, e, 20000, 1800, 18200) for e in range(1, N_EMP + 1)],
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO attendance_logs(employee_id, day, punch_in, punch_out, source) VALUES (?,?,?,?,?)",
+            [(e, 19000 + d, 540, 1080, "csv") for d in range(60) for e in range(1, N_EMP + 1)],
+        )
+
+def _bulk_write(engine, rows: int, chunk: int = 20_000):
+    # one long transaction, written chunk by chunk like a checkpointed batch
+    with engine.begin() as conn:
+        for start in range(0, rows, chunk):
+            conn.exec_driver_sql(
+                "INSERT INTO attendance_logs(employee_id, day, punch_in, punch_out, source) VALUES (?,?,?,?,?)",
+                [(i % N_EMP + 1, 20000 + i // N_EMP, 540, 1080, "bench") for i in range(start, min(start + chunk, rows))],
+            )
+
+def _reader(engine, stop, out):
+    lat, locked, i = [], 0, 0
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        try:
+            with engine.connect() as conn:
+                conn.exec_driver_sql(READS[i % len(READS)]).fetchall()
+            lat.append(time.perf_counter() - t0)
+        except OperationalError:
+            locked += 1
+        i += 1
+        time.sleep(THINK)
+    out.append((lat, locked))
+
+def _phase(engine, n_readers: int, work):
+    stop, out = threading.Event(), []
+    threads = [threading.Thread(target=_reader, args=(engine, stop, out)) for _ in range(n_readers)]
+    for t in threads:
+        t.start()
+    t0 = time.perf_counter()
+    work()
+    took = time.perf_counter() - t0
+    stop.set()
+    for t in threads:
+        t.join()
+    lat = np.array([x for l, _ in out for x in l]) * 1000
+    return took, lat, sum(k for _, k in out)
+
+def _profile(label: str, pragmas, n_readers: int, rows: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = make_engine(f"sqlite+pysqlite:///{os.path.join(tmp, 'bench.db')}", pragmas=pragmas)
+        migrate(engine)
+        _populate(engine)
+        for phase, work in (("idle", lambda: time.sleep(2)), ("bulk write", lambda: _bulk_write(engine, rows))):
+            took, lat, locked = _phase(engine, n_readers, work)
+            if len(lat):
+                p50, p95, mx = np.percentile(lat, 50), np.percentile(lat, 95), lat.max()
+            else:
+                p50 = p95 = mx = float("nan")
+            print(f"  {label:18s} {phase:11s} {took:6.2f}s {len(lat):7,d} {p50:8.2f} {p95:8.2f} {mx:9.2f} {locked:7,d}")
+        engine.dispose()
+
+def main(n_readers: int = 4, rows: int = 400_000):
+    print(f"{n_readers} readers, bulk write of {rows:,} attendance rows in one transaction")
+    print(f"  {'profile':18s} {'phase':11s} {'took':>7s} {'reads':>7s} {'p50 ms':>8s} {'p95 ms':>8s} {'max ms':>9s} {'locked':>7s}")
+    # pysqlite defaults: rollback journal, synchronous=FULL, 2 MiB cache, 5 s lock timeout
+    _profile("default (journal)", {}, n_readers, rows)
+    _profile("SQLITE_PRAGMAS", SQLITE_PRAGMAS, n_readers, rows)
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:3]))
@@ -0,0 +1,93 @@
+# bench/matching.py
+"""
+Indexed name matcher vs the old exhaustive SequenceMatcher scan, on a
+generated reference set (exact names, typos, swapped/merged tokens, strangers).
+Checks that both return identical matches at threshold 0.86.
+Run from the repo root:  python -m bench.matching [n_employees] [n_rows]
+"""
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from lib.matching import _full, _norm, best_match, match_consolidated_names
+
+FIRST = ["AMIT", "SARA", "ROHIT", "NEHA", "VIKRAM", "PRIYA", "ANIL", "SUNITA", "RAJ", "KAVYA",
+         "ARJUN", "MEERA", "SURESH", "LATA", "DEEPAK", "ASHA", "KIRAN", "MANOJ", "POOJA", "RAVI"]
+LAST = ["KUMAR", "IYER", "DAS", "SHARMA", "PATEL", "NAIR", "REDDY", "SINGH", "GUPTA", "MENON",
+        "JOSHI", "RAO", "MEHTA", "PILLAI", "BOSE", "KULKARNI", "CHOUDHARY", "VERMA", "SHETTY", "SEN"]
+
+def _legacy(df_consol: pd.DataFrame, df_employees: pd.DataFrame, threshold: float = 0.86) -> pd.DataFrame:
+    # the per-row scan match_consolidated_names used before NameIndex
+    df_employees = df_employees.fillna("")
+    df_employees["full_norm"] = df_employees.apply(lambda r: _full(r["first_name"], r["last_name"]), axis=1)
+    pool = df_employees["full_norm"].tolist()
+    out = []
+    for _, row in df_consol.iterrows():
+        raw_name = str(row.get("name", ""))
+        needle = _norm(raw_name)
+        exact = df_employees[df_employees["full_norm"] == needle]
+        if not exact.empty:
+            r, kind, score = exact.iloc[0], "exact", 1.0
+        else:
+            best, score = best_match(needle, pool, threshold)
+            r = df_employees[df_employees["full_norm"] == best].iloc[0] if best else None
+            kind, score = ("fuzzy", round(float(score), 4)) if best else ("unmatched", 0.0)
+        out.append({
+            "name": raw_name, "designation": row.get("designation"),
+            "wage_rate": row.get("wage_rate"), "net": row.get("net"),
+            "emp_id": int(r["id"]) if r is not None else None,
+            "emp_name": f"{r['first_name']} {r['last_name']}".strip() if r is not None else "",
+            "match_type": kind, "score": score,
+        })
+    return pd.DataFrame(out)
+
+def _mutate(name: str, rng) -> str:
+    s = list(name)
+    for _ in range(rng.integers(1, 3)):
+        i = int(rng.integers(0, len(s)))
+        op = rng.integers(0, 3)
+        if op == 0:
+            s[i] = chr(65 + int(rng.integers(0, 26)))
+        elif op == 1 and len(s) > 3:
+            del s[i]
+        else:
+            s.insert(i, chr(65 + int(rng.integers(0, 26))))
+    return "".join(s)
+
+def _dataset(n_emp: int, n_rows: int):
+    rng = np.random.default_rng(0)
+    first = rng.choice(FIRST, n_emp) + np.where(rng.random(n_emp) < 0.7, rng.choice(list("ABCDEFGH"), n_emp), "")
+    last = rng.choice(LAST, n_emp) + rng.choice(["", "A", "AN", "ESH", "I"], n_emp)
+    emp = pd.DataFrame({"id": np.arange(1, n_emp + 1), "first_name": first.astype(str), "last_name": last.astype(str)})
+    full = (emp["first_name"] + " " + emp["last_name"]).tolist()
+    names = []
+    for _ in range(n_rows):
+        base = full[int(rng.integers(0, n_emp))]
+        kind = rng.random()
+        names.append(base if kind < 0.4 else
+                     _mutate(base, rng) if kind < 0.8 else
+                     base.lower().replace(" ", ".") if kind < 0.9 else
+                     f"{rng.choice(FIRST)}{rng.choice(LAST)} X")
+    consol = pd.DataFrame({"name": names, "designation": "Operator",
+                           "wage_rate": 500.0, "net": rng.integers(8_000, 40_000, n_rows).astype(float)})
+    return consol, emp
+
+def main(n_emp: int = 2_000, n_rows: int = 500):
+    consol, emp = _dataset(n_emp, n_rows)
+    t0 = time.perf_counter(); old = _legacy(consol, emp); t_old = time.perf_counter() - t0
+    t0 = time.perf_counter(); new = match_consolidated_names(consol, emp); t_new = time.perf_counter() - t0
+    same = old.astype(str).equals(new.astype(str))
+    print(f"{n_rows:,} statement rows x {n_emp:,} employees")
+    print(f"  exhaustive scan : {t_old:9.2f} s  ({n_rows / t_old:9.0f} rows/s)")
+    print(f"  NameIndex       : {t_new:9.2f} s  ({n_rows / t_new:9.0f} rows/s)")
+    print(f"  speedup         : {t_old / t_new:9.1f}x")
+    print(f"  match types     : {new['match_type'].value_counts().to_dict()}")
+    print(f"  identical       : {same}")
+    if not same:
+        diff = old.astype(str).ne(new.astype(str)).any(axis=1)
+        print(pd.concat([old[diff], new[diff]], axis=1).head(10).to_string())
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:3]))
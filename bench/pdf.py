@@ -0,0 +1,43 @@
+# bench/pdf.py
+"""
+Template-stamped payslips vs a fresh ReportLab canvas per slip.
+Run from the repo root:  python -m bench.pdf [n_slips]
+"""
+import sys
+import time
+from io import BytesIO
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from lib.pdf import PAYSLIP_FIELDS_DETAILED, payslip_template
+
+def _canvas_payslip(slip, fields):
+    # how build_payslip_pdf rendered before the template renderer
+    buf = BytesIO()
+    c = canvas.Canvas(buf, pagesize=A4)
+    c.setFont("Helvetica-Bold", 16)
+    c.drawString(50, 800, f"Payslip  {slip['month']:02d}/{slip['year']}")
+    c.setFont("Helvetica", 12)
+    y = 770
+    for label, key in fields:
+        v = slip[key]
+        c.drawString(50, y, f"{label}: {v:,.2f}" if isinstance(v, float) else f"{label}: {v}")
+        y -= 20
+    c.showPage(); c.save()
+    return buf.getvalue()
+
+def main(n: int = 2000):
+    fields = PAYSLIP_FIELDS_DETAILED
+    slips = [{"name": f"Employee {i}", "code": f"E{i:05d}", "month": 3, "year": 2025,
+              **{k: 1000.0 + i for _, k in fields[2:]}} for i in range(n)]
+    tpl = payslip_template(fields)
+
+    t0 = time.perf_counter(); old = [_canvas_payslip(s, fields) for s in slips]; t_old = time.perf_counter() - t0
+    t0 = time.perf_counter(); new = [tpl.render(s) for s in slips]; t_new = time.perf_counter() - t0
+    print(f"{n:,} detailed payslips")
+    print(f"  reportlab canvas : {t_old / n * 1e6:8.1f} us/slip  {sum(map(len, old)) / n:8.0f} B/slip")
+    print(f"  cached template  : {t_new / n * 1e6:8.1f} us/slip  {sum(map(len, new)) / n:8.0f} B/slip")
+    print(f"  speedup          : {t_old / t_new:8.1f}x")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
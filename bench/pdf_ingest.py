@@ -0,0 +1,91 @@
+# bench/pdf_ingest.py
+"""
+Single-pass, early-stopping parse_payslip vs the old parser (full-document
+text + 14 uncompiled re.search calls) on generated sample slips: one-page
+slips, slips with annex pages after the pay block, and slips missing fields
+(the new parser still stops at the NET PAYABLE line instead of searching the
+annex). Checks that every parsed field is identical.
+Run from the repo root:  python -m bench.pdf_ingest [n_slips] [annex_pages]
+"""
+import re
+import sys
+import time
+from io import BytesIO
+from reportlab.pdfgen import canvas
+
+from lib.pdf_ingest import MONTH_MAP, _extract_text, parse_payslip
+
+def _legacy(file_bytes: bytes):
+    # parse_payslip before the precompiled, page-at-a-time rewrite
+    text = _extract_text(file_bytes)
+
+    def num(pat):
+        m = re.search(pat, text, re.I)
+        if not m: return None
+        s = m.group(1).replace(",", "")
+        try: return float(s)
+        except: return None
+
+    m = re.search(r"PAY SLIP FOR THE MONTH OF\s+([A-Z]{3})\s+(\d{4})", text, re.I)
+    month = MONTH_MAP.get(m.group(1).upper(), None) if m else None
+    year = int(m.group(2)) if m else None
+    mname = re.search(r"NAME OF THE STAFF:\s*([A-Z][A-Z\s\.\-']+)", text, re.I)
+    name = mname.group(1).strip() if mname else None
+    return {
+        "name": name, "month": month, "year": year,
+        "gross": num(r"(?:SUB TOTAL|GROSS SALARY|SUB\s*TOTAL.*\[B\])\D+([0-9\.,]+)"),
+        "basic": num(r"BASIC\s*PAY.*?:\s*([0-9\.,]+)"),
+        "hra": num(r"H\.?R\.?A.*?:\s*([0-9\.,]+)"),
+        "pf_ee": num(r"PROVIDENT FUND\s*\(EMPLOYEE\).*?:\s*([0-9\.,]+)"),
+        "pf_er": num(r"PROVIDENT FUND\s*\(EMPLOYER\).*?:\s*([0-9\.,]+)"),
+        "esi_ee": num(r"E\.?S\.?I\.?C\.?\s*\(EMPLOYEE\).*?:\s*([0-9\.,]+)"),
+        "esi_er": num(r"E\.?S\.?I\.?C\.?\s*\(EMPLOYER\).*?:\s*([0-9\.,]+)"),
+        "lwf_ee": num(r"L\.?W\.?F\.?\s*\(EMPLOYEE\).*?:\s*([0-9\.,]+)"),
+        "lwf_er": num(r"L\.?W\.?F\.?\s*\(EMPLOYER\).*?:\s*([0-9\.,]+)"),
+        "admin_pf": num(r"ADMIN.*?CHARGES.*?:\s*([0-9\.,]+)"),
+        "net": num(r"NET\s*(?:PAYABLE|PAY).+?:\s*Rs?\.?\s*([0-9\.,]+)"),
+        "raw_text": text,
+    }
+
+def _slip(i: int, annex: int, complete: bool = True) -> bytes:
+    lines = [
+        "PAY SLIP FOR THE MONTH OF MAR 2025", f"NAME OF THE STAFF: EMPLOYEE {chr(65 + i % 26)} SHARMA",
+        f"BASIC PAY (FIXED) : {20000 + i:,}.00", "H.R.A. : 1,000.00", f"SUB TOTAL [B] Rs. {25000 + i:,}.00",
+        "PROVIDENT FUND (EMPLOYEE) @12% : 1,800.00", "PROVIDENT FUND (EMPLOYER) @13% : 1,950.00",
+        "E.S.I.C. (EMPLOYEE) : 188.00", "E.S.I.C. (EMPLOYER) : 813.00",
+        "L.W.F. (EMPLOYEE) : 12.00", "L.W.F. (EMPLOYER) : 36.00", "ADMIN / EDLI CHARGES : 125.00",
+        f"NET PAYABLE AMOUNT : Rs. {23000 + i:,}.00",
+    ]
+    if not complete:
+        lines = [ln for ln in lines if not ln.startswith(("L.W.F", "ADMIN"))]
+    buf = BytesIO()
+    c = canvas.Canvas(buf)
+    y = 800
+    for ln in lines:
+        c.drawString(50, y, ln); y -= 18
+    for p in range(annex):
+        c.showPage()
+        y = 800
+        for d in range(1, 32):
+            c.drawString(50, y, f"ANNEX {p + 1} DAY {d:02d} IN 09:00 OUT 18:00 HOURS 9"); y -= 18
+    c.save()
+    return buf.getvalue()
+
+def _run(label: str, slips):
+    t0 = time.perf_counter(); old = [_legacy(b) for b in slips]; t_old = time.perf_counter() - t0
+    t0 = time.perf_counter(); new = [parse_payslip(b) for b in slips]; t_new = time.perf_counter() - t0
+    fields = lambda d: {k: v for k, v in d.items() if k != "raw_text"}
+    same = all(fields(a) == fields(b) for a, b in zip(old, new))
+    print(f"{label:<28} old {t_old * 1000 / len(slips):7.1f} ms/slip   new {t_new * 1000 / len(slips):7.1f} ms/slip"
+          f"   {t_old / t_new:5.1f}x   identical fields: {same}")
+    return same
+
+def main(n: int = 50, annex: int = 4):
+    ok = _run("one page", [_slip(i, 0) for i in range(n)])
+    ok &= _run(f"pay block + {annex} annex pages", [_slip(i, annex) for i in range(n)])
+    ok &= _run("missing fields (stop at net)", [_slip(i, annex, complete=False) for i in range(n)])
+    if not ok:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:3]))
@@ -0,0 +1,86 @@
+# bench/schema.py
+"""
+Query timings before/after migrations 2-3 (indexes + typed attendance columns)
+on a generated SQLite dataset.
+Run from the repo root:  python -m bench.schema [n_employees] [n_days]
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+import numpy as np
+from sqlalchemy import create_engine
+
+from lib.migrations import migrate
+
+def _populate(engine, n_emp: int, n_days: int):
+    rng = np.random.default_rng(0)
+    start = date(2024, 1, 1)
+    days = [(start + timedelta(d)).isoformat() for d in range(n_days)]
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "INSERT INTO employees(code, first_name, last_name, base_salary) VALUES (?,?,?,?)",
+            [(f"E{i:05d}", "F", "L", 20000) for i in range(1, n_emp + 1)],
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO attendance_logs(employee_id, day, punch_in, punch_out, source) VALUES (?,?,?,?,?)",
+            [(e, d, f"09:{m:02d}", "18:00", "csv")
+             for d in days for e, m in zip(range(1, n_emp + 1), rng.integers(0, 60, n_emp))],
+        )
+        for i in range(24):
+            run = conn.exec_driver_sql(
+                "INSERT INTO payroll_runs(month, year, status) VALUES (?,?,?) RETURNING id",
+                (i % 12 + 1, 2023 + i // 12, "Completed"),
+            ).scalar()
+            conn.exec_driver_sql(
+                "INSERT INTO payslips(run_id, employee_id, gross, deductions, net) VALUES (?,?,?,?,?)",
+                [(run, e, 20000, 1800, 18200) for e in range(1, n_emp + 1)],
+            )
+
+def _queries(typed: bool, n_emp: int):
+    d0, d1 = (date(2024, 2, 1), date(2024, 2, 29))
+    if typed:
+        epoch = date(1970, 1, 1)
+        d0, d1 = (d0 - epoch).days, (d1 - epoch).days
+    else:
+        d0, d1 = d0.isoformat(), d1.isoformat()
+    emp = n_emp // 2
+    return [
+        ("dashboard: punches per day (last 30)",
+         "SELECT day, COUNT(*) FROM attendance_logs GROUP BY day ORDER BY day DESC LIMIT 30", ()),
+        ("one employee, one month of attendance",
+         "SELECT * FROM attendance_logs WHERE employee_id=? AND day BETWEEN ? AND ?", (emp, d0, d1)),
+        ("payslips of a run", "SELECT SUM(net) FROM payslips WHERE run_id=?", (12,)),
+        ("payslips of an employee", "SELECT * FROM payslips WHERE employee_id=?", (emp,)),
+        ("run by period", "SELECT id FROM payroll_runs WHERE year=? AND month=?", (2024, 6)),
+    ]
+
+def _time(engine, sql, params, repeat: int = 5) -> float:
+    best = float("inf")
+    with engine.connect() as conn:
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            conn.exec_driver_sql(sql, params).fetchall()
+            best = min(best, time.perf_counter() - t0)
+    return best
+
+def main(n_emp: int = 2000, n_days: int = 180):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite+pysqlite:///{os.path.join(tmp, 'bench.db')}")
+        migrate(engine, target=1)
+        _populate(engine, n_emp, n_days)
+        before = [_time(engine, sql, p) for _, sql, p in _queries(False, n_emp)]
+        t0 = time.perf_counter(); migrate(engine, target=3); t_mig = time.perf_counter() - t0
+        migrate(engine)
+        after = [_time(engine, sql, p) for _, sql, p in _queries(True, n_emp)]
+
+    print(f"{n_emp:,} employees x {n_days} days = {n_emp * n_days:,} attendance rows, "
+          f"{24 * n_emp:,} payslips (migrations 2-3 took {t_mig:.1f}s)")
+    print(f"  {'query':40s} {'v1 ms':>9s} {'latest ms':>10s}")
+    for (label, _, _), b, a in zip(_queries(True, n_emp), before, after):
+        print(f"  {label:40s} {b*1000:9.2f} {a*1000:10.2f}")
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    main(*args)
@@ -0,0 +1,42 @@
+# bench/statutory.py
+"""
+Vectorized statutory engine vs the old per-row payroll loop.
+Run from the repo root:  python -m bench.statutory [n_employees]
+"""
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from lib.statutory import compute_statutory
+
+def _legacy_loop(df: pd.DataFrame):
+    # the loop run_payroll used before lib.statutory existed
+    out = []
+    for r in df.itertuples(index=False):
+        basic = float(r.base_salary)
+        pf = round(basic * 0.12, 2)
+        tds = 0.0
+        gross = basic
+        deductions = pf + tds
+        out.append((gross, deductions, gross - deductions))
+    return out
+
+def _employees(n: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        "id": np.arange(1, n + 1),
+        "base_salary": rng.integers(8_000, 250_000, n).astype(float),
+    })
+
+def main(n: int = 100_000):
+    df = _employees(n)
+    t0 = time.perf_counter(); _legacy_loop(df); t_loop = time.perf_counter() - t0
+    t0 = time.perf_counter(); compute_statutory(df); t_vec = time.perf_counter() - t0
+    print(f"{n:,} employees")
+    print(f"  legacy loop (PF only) : {t_loop*1000:9.1f} ms")
+    print(f"  compute_statutory     : {t_vec*1000:9.1f} ms  (all components)")
+    print(f"  speedup               : {t_loop / t_vec:9.1f}x")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,179 @@
+# lib/attendance.py
+from __future__ import annotations
+import uuid
+from typing import Callable, Dict, Optional
+import pandas as pd
+
+from .cache import touch
+from .db import bulk_insert_returning, copy_rows
+from .rollups import add_attendance_days
+
+ATT_COLUMNS = ["employee_id", "day", "punch_in", "punch_out", "source"]
+ATT_KEY = "employee_id, day, punch_in"
+# stands in for a NULL punch_in in the unique key (migration 9), so rows
+# without one still conflict on re-import
+NO_PUNCH = {"sqlite": "-1", "postgresql": "'-infinity'::timestamp"}
+
+def _conflict_key(dialect: str) -> str:
+    return f"employee_id, day, (COALESCE(punch_in, {NO_PUNCH[dialect]}))"
+CSV_DTYPES = {"code": "string", "day": "category", "punch_in": "string",
+              "punch_out": "string", "source": "category"}
+
+def _split_name(name: str):
+    parts = [p for p in str(name or "").replace(".", "").split() if p]
+    return (parts[0], " ".join(parts[1:])) if parts else ("", "")
+
+def _employee_ids(conn) -> pd.Series:
+    rows = conn.exec_driver_sql("SELECT id, code FROM employees").fetchall()
+    ids = pd.Series({str(code).strip(): int(i) for i, code in rows}, dtype="int64")
+    ids.index.name = "code"
+    return ids
+
+def _create_missing(conn, codes, code_to_name: Dict[str, str]) -> pd.Series:
+    # one batched INSERT ... RETURNING for every unknown code in the chunk
+    rows = [(c, *_split_name(code_to_name.get(c, "")), 0, 1) for c in codes]
+    made = bulk_insert_returning(conn, "employees", ("code", "first_name", "last_name", "base_salary", "active"),
+                                 rows, returning="id, code")
+    return pd.Series({code: int(i) for i, code in made}, dtype="int64")
+
+def _to_datetime(s: pd.Series) -> pd.Series:
+    # fast path infers one format for the column; values in any other format get a per-value retry
+    out = pd.to_datetime(s, errors="coerce")
+    retry = out.isna() & s.notna()
+    if retry.any():
+        out = out.where(~retry, pd.to_datetime(s[retry], errors="coerce", format="mixed"))
+    return out
+
+def _punch(col: pd.Series, day: pd.Series):
+    """
+    Full timestamps parse as-is; time-only values ('9:00', '09:00', '09:00:00')
+    are placed on their day. Returns (timestamps, bad) where `bad` marks
+    non-empty values that did not parse.
+    """
+    s = col.astype("string").str.strip().replace({"": pd.NA, "nan": pd.NA})
+    time_only = s.str.fullmatch(r"\d{1,2}:\d{2}(?::\d{2})?").fillna(False).astype(bool)
+    t = s.where(time_only)
+    t = t.where(t.str.count(":") == 2, t + ":00").astype(object).where(t.notna(), None)
+    td = pd.to_timedelta(t, errors="coerce")
+    td = td.where(td < pd.Timedelta(days=1))
+    full = _to_datetime(s.where(~time_only).astype(object).where(s.notna() & ~time_only, None))
+    out = full.fillna(day + td)
+    return out, (out.isna() & s.notna()).astype(bool)
+
+def _typed_times(rows: pd.DataFrame, sqlite: bool):
+    """
+    Parse day/punch_in/punch_out once in pandas. SQLite stores day as INTEGER
+    days since 1970-01-01 and punches as INTEGER unix seconds (migration 3);
+    Postgres takes the datetimes as-is for its DATE/TIMESTAMP columns.
+    Returns (typed, rejected): rows whose day or a non-empty punch does not
+    parse go to `rejected` (original values plus a `reason` column).
+    """
+    day = _to_datetime(rows["day"].astype("string").str.strip()).dt.normalize()
+    punch_in, bad_in = _punch(rows["punch_in"], day)
+    punch_out, bad_out = _punch(rows["punch_out"], day)
+    bad_day = day.isna()
+    reason = pd.Series(None, index=rows.index, dtype=object)
+    reason = reason.mask(bad_out, "unparseable punch_out").mask(bad_in, "unparseable punch_in").mask(bad_day, "unparseable day")
+    ok = reason.isna()
+    rejected = rows[~ok].assign(reason=reason[~ok])
+    rows = rows.assign(day=day, punch_in=punch_in, punch_out=punch_out)[ok]
+    if sqlite:
+        epoch = pd.Timestamp("1970-01-01")
+        rows = rows.assign(**{
+            "day": ((rows["day"] - epoch) // pd.Timedelta(days=1)).astype("int64"),
+            **{c: ((rows[c] - epoch) // pd.Timedelta(seconds=1)).astype("Int64")
+               for c in ("punch_in", "punch_out")},
+        })
+    return rows, rejected
+
+def _merge_staged(conn, batch: str):
+    """
+    Upsert one staged batch into attendance_logs on (employee_id, day, punch_in),
+    a missing punch_in counting as one value (see NO_PUNCH),
+    and add the newly inserted punches to the attendance_daily rollup.
+    Returns (inserted, updated); duplicate keys within the batch collapse to
+    one row first, so staged rows not counted here were skipped.
+    """
+    sqlite = conn.dialect.name == "sqlite"
+    p = "?" if sqlite else "%s"
+    ne = "IS NOT" if sqlite else "IS DISTINCT FROM"
+    none = NO_PUNCH[conn.dialect.name]
+    staged = f"""
+        SELECT employee_id, day, punch_in, MAX(punch_out) AS punch_out, MAX(source) AS source
+        FROM attendance_staging WHERE batch = {p} GROUP BY {ATT_KEY}
+    """
+    per_day = conn.exec_driver_sql(f"""
+        SELECT s.day,
+               SUM(CASE WHEN a.id IS NULL THEN 1 ELSE 0 END),
+               SUM(CASE WHEN a.id IS NOT NULL AND (a.punch_out {ne} s.punch_out OR a.source {ne} s.source)
+                        THEN 1 ELSE 0 END)
+        FROM ({staged}) s
+        LEFT JOIN attendance_logs a
+          ON a.employee_id = s.employee_id AND a.day = s.day
+         AND COALESCE(a.punch_in, {none}) = COALESCE(s.punch_in, {none})
+        GROUP BY s.day
+    """, (batch,)).fetchall()
+    conn.exec_driver_sql(f"""
+        INSERT INTO attendance_logs({', '.join(ATT_COLUMNS)})
+        SELECT * FROM ({staged}) s WHERE true
+        ON CONFLICT({_conflict_key(conn.dialect.name)}) DO UPDATE SET punch_out = excluded.punch_out, source = excluded.source
+        WHERE attendance_logs.punch_out {ne} excluded.punch_out OR attendance_logs.source {ne} excluded.source
+    """, (batch,))
+    conn.exec_driver_sql(f"DELETE FROM attendance_staging WHERE batch = {p}", (batch,))
+    add_attendance_days(conn, [(day, new) for day, new, _ in per_day])
+    return sum(int(n) for _, n, _ in per_day), sum(int(u) for _, _, u in per_day)
+
+def import_attendance(engine, source, code_to_name: Optional[Dict[str, str]] = None,
+                      auto_create: bool = True, chunksize: int = 100_000,
+                      progress: Optional[Callable[[Dict[str, int]], None]] = None) -> Dict[str, int]:
+    """
+    Stream an attendance CSV (code, day, punch_in, punch_out[, source]) into
+    attendance_logs chunk by chunk, so memory stays flat regardless of file size.
+    Codes map to employee ids with a vectorized merge; unknown codes are
+    created in one batch per chunk when auto_create is set, otherwise skipped.
+    Each chunk is bulk-loaded (COPY on Postgres, executemany on SQLite) into
+    attendance_staging and upserted on (employee_id, day, punch_in) in its own
+    transaction, so re-importing a file is a no-op. `progress(stats)` is called
+    after every chunk.
+    Returns stats: rows, inserted, updated, skipped (already present/duplicate),
+    created, unmatched (rows with unknown codes), invalid (unparseable day or punch),
+    missing (unknown codes seen).
+    """
+    code_to_name = code_to_name or {}
+    stats = {"rows": 0, "inserted": 0, "updated": 0, "skipped": 0,
+             "created": 0, "unmatched": 0, "invalid": 0, "missing": 0}
+    batch = uuid.uuid4().hex
+    with engine.connect() as conn:
+        ids = _employee_ids(conn)
+    missing_seen = set()
+
+    for chunk in pd.read_csv(source, dtype=CSV_DTYPES, chunksize=chunksize):
+        stats["rows"] += len(chunk)
+        chunk["code"] = chunk["code"].str.strip()
+        if "source" not in chunk:
+            chunk["source"] = "csv"
+        chunk["source"] = chunk["source"].astype("string").fillna("csv")
+
+        with engine.begin() as conn:
+            unknown = pd.Index(chunk["code"].dropna().unique()).difference(ids.index)
+            if len(unknown):
+                missing_seen.update(unknown)
+                if auto_create:
+                    made = _create_missing(conn, sorted(unknown), code_to_name)
+                    ids = pd.concat([ids, made])
+                    stats["created"] += len(made)
+
+            rows = chunk.merge(ids.rename("employee_id"), left_on="code", right_index=True, how="inner")
+            stats["unmatched"] += len(chunk) - len(rows)
+            rows, rejected = _typed_times(rows, conn.dialect.name == "sqlite")
+            stats["invalid"] += len(rejected)
+            copy_rows(conn, "attendance_staging", ["batch"] + ATT_COLUMNS, rows.assign(batch=batch))
+            ins, upd = _merge_staged(conn, batch)
+            stats["inserted"] += ins; stats["updated"] += upd; stats["skipped"] += len(rows) - ins - upd
+            touch(conn, "attendance_logs", "attendance_daily", *(["employees"] if len(unknown) and auto_create else []))
+
+        if progress:
+            progress(dict(stats, missing=len(missing_seen)))
+
+    stats["missing"] = len(missing_seen)
+    return stats
@@ -0,0 +1,113 @@
+# lib/cache.py
+"""
+Process-wide read cache for page queries, shared by all Streamlit sessions.
+
+Entries are keyed on (sql, params) and declare the tables they read. Write
+paths call touch(conn, <tables>) inside their transaction: it bumps each
+table's counter in the table_generations table and drops exactly the local
+entries that depend on it. Reads compare those shared counters (at most every
+QUERY_CACHE_SYNC seconds) so writes from other processes -- the lib.cli cron
+jobs, a second server -- invalidate this cache too. Bounded LRU.
+"""
+from __future__ import annotations
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Sequence, Tuple
+import pandas as pd
+
+CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_SIZE", "256"))
+CACHE_SYNC_SECONDS = float(os.getenv("QUERY_CACHE_SYNC", "2"))
+
+_lock = threading.Lock()
+_entries: "OrderedDict[Tuple[str, tuple], Tuple[frozenset, Any]]" = OrderedDict()
+_generations: Dict[str, int] = {}
+_shared: Dict[str, int] = {}  # table_generations as of the last sync
+_synced_at = float("-inf")
+_stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0, "syncs": 0}
+
+def generation(table: str) -> int:
+    return _generations.get(table, 0)
+
+def invalidate(*tables: str) -> None:
+    """Bump the local generation of `tables` and drop every cached read that touched them."""
+    with _lock:
+        for t in tables:
+            _generations[t] = _generations.get(t, 0) + 1
+        stale = [k for k, (deps, _) in _entries.items() if deps.intersection(tables)]
+        for k in stale:
+            del _entries[k]
+        _stats["invalidations"] += len(stale)
+
+def touch(conn, *tables: str) -> None:
+    """
+    Record a write to `tables` from inside the writing transaction: bumps the
+    shared counters (seen by every process at its next sync) and invalidates
+    this process's entries right away.
+    """
+    p = "?" if conn.dialect.name == "sqlite" else "%s"
+    conn.exec_driver_sql(
+        f"INSERT INTO table_generations(name, gen) VALUES ({p}, 1) "
+        "ON CONFLICT(name) DO UPDATE SET gen = table_generations.gen + 1",
+        [(t,) for t in sorted(set(tables))],
+    )
+    invalidate(*tables)
+
+def _sync(engine) -> None:
+    # pull the shared counters; tables whose counter moved since the last sync were
+    # written elsewhere (or by us, racing a reload) and are invalidated here
+    global _synced_at
+    now = time.monotonic()
+    if now - _synced_at < CACHE_SYNC_SECONDS:
+        return
+    _synced_at = now
+    try:
+        with engine.connect() as conn:
+            gens = dict(conn.exec_driver_sql("SELECT name, gen FROM table_generations").fetchall())
+    except Exception:  # not migrated yet
+        return
+    with _lock:
+        changed = [t for t, g in gens.items() if _shared.get(t) != g]
+        _shared.update(gens)
+        _stats["syncs"] += 1
+    if changed:
+        invalidate(*changed)
+
+def _cached(engine, key, tables: Iterable[str], load):
+    _sync(engine)
+    with _lock:
+        hit = _entries.get(key)
+        if hit is not None:
+            _entries.move_to_end(key)
+            _stats["hits"] += 1
+            return hit[1]
+        _stats["misses"] += 1
+        gens = tuple(generation(t) for t in tables)
+    value = load()
+    with _lock:
+        # skip storing if a write landed while we were loading
+        if gens == tuple(generation(t) for t in tables):
+            _entries[key] = (frozenset(tables), value)
+            _entries.move_to_end(key)
+            while len(_entries) > CACHE_MAX_ENTRIES:
+                _entries.popitem(last=False)
+                _stats["evictions"] += 1
+    return value
+
+def read_df(engine, sql: str, tables: Sequence[str], params: Optional[tuple] = None) -> pd.DataFrame:
+    """pd.read_sql through the cache; returns a copy callers may modify."""
+    def load():
+        with engine.connect() as conn:
+            return pd.read_sql(sql, conn.connection, params=params)
+    return _cached(engine, (sql, tuple(params or ())), tables, load).copy()
+
+def read_scalar(engine, sql: str, tables: Sequence[str], params: Optional[tuple] = None):
+    def load():
+        with engine.connect() as conn:
+            return conn.exec_driver_sql(sql, tuple(params or ())).scalar()
+    return _cached(engine, ("scalar:" + sql, tuple(params or ())), tables, load)
+
+def cache_stats() -> Dict[str, int]:
+    with _lock:
+        return dict(_stats, entries=len(_entries), max_entries=CACHE_MAX_ENTRIES)
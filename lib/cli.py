@@ -0,0 +1,229 @@
+# lib/cli.py
+"""
+Headless month-end processing against lib.db.engine (no Streamlit import).
+
+    python -m lib.cli payroll 2025-03 2025-04 [--merged] [--workers N]
+    python -m lib.cli attendance exports/ 'logs/*.csv' [--map codes.csv] [--no-create]
+    python -m lib.cli payslips slips/ march.zip [--workers N] [--report report.csv]
+    python -m lib.cli consolidated 'statements/*.pdf' [--out matched.csv] [--write --month 3 --year 2025]
+
+Inputs may be files, directories (searched recursively) or globs. Every
+command prints per-item timings and a throughput summary. The database comes
+from DATABASE_URL or .streamlit/secrets.toml, else the local SQLite file.
+"""
+from __future__ import annotations
+import argparse
+import glob
+import os
+import sys
+import time
+from typing import Iterable, List
+
+def expand_inputs(paths: Iterable[str], exts) -> List[str]:
+    """Files, directories (recursive) and globs -> sorted unique files with one of `exts`."""
+    out = set()
+    for p in paths:
+        if os.path.isdir(p):
+            for root, _, files in os.walk(p):
+                out.update(os.path.join(root, f) for f in files if f.lower().endswith(exts))
+        elif any(c in p for c in "*?["):
+            out.update(f for f in glob.glob(p, recursive=True) if os.path.isfile(f) and f.lower().endswith(exts))
+        elif os.path.isfile(p):
+            out.add(p)
+        else:
+            print(f"skipping {p}: no such file or directory", file=sys.stderr)
+    return sorted(out)
+
+def period(s: str):
+    """argparse type: 'YYYY-MM' -> (year, month)."""
+    try:
+        year, month = (int(x) for x in s.split("-"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{s!r} is not YYYY-MM")
+    if not 1 <= month <= 12:
+        raise argparse.ArgumentTypeError(f"{s!r}: month must be 01-12")
+    return year, month
+
+def _done_progress() -> None:
+    # end the \r progress line so the summary doesn't print over it
+    print(file=sys.stderr, flush=True)
+
+def _rate(n: int, seconds: float) -> str:
+    return f"{n / seconds:,.1f}/s" if seconds > 0 else "-"
+
+def cmd_payroll(engine, args) -> int:
+    from .payroll import run_payroll
+
+    total_emp = total_redone = 0
+    t_all = time.perf_counter()
+    for year, month in args.periods:
+        t0 = time.perf_counter()
+        try:
+            results = run_payroll(
+                engine, month, year, workers=args.workers, merged=args.merged,
+                progress=lambda done, todo: print(f"  {done:,}/{todo:,} rendered & stored", end="\r", file=sys.stderr, flush=True),
+            )
+        finally:
+            _done_progress()
+        dt_ = time.perf_counter() - t0
+        redone = sum(r["rendered"] for r in results)
+        uploaded = sum(not r["reused"] for r in results if r["rendered"])
+        print(f"payroll {month:02d}/{year}: {len(results):,} employees, {redone:,} recomputed, "
+              f"{uploaded:,} uploaded in {dt_:.2f}s ({_rate(redone, dt_)} slips)")
+        total_emp += len(results); total_redone += redone
+    dt_ = time.perf_counter() - t_all
+    print(f"total: {len(args.periods)} period(s), {total_emp:,} employees, {total_redone:,} recomputed "
+          f"in {dt_:.2f}s ({_rate(total_redone, dt_)} slips)")
+    return 0
+
+def cmd_attendance(engine, args) -> int:
+    import pandas as pd
+    from .attendance import import_attendance
+
+    files = expand_inputs(args.paths, (".csv",))
+    if not files:
+        print("no CSV files found", file=sys.stderr)
+        return 1
+    code_to_name = {}
+    if args.map:
+        m = pd.read_csv(args.map, dtype={"code": str, "name": str}).fillna("")
+        code_to_name = dict(zip(m["code"].str.strip(), m["name"].str.strip()))
+        code_to_name.pop("", None)
+    totals, t_all = {}, time.perf_counter()
+    for path in files:
+        t0 = time.perf_counter()
+        stats = import_attendance(engine, path, code_to_name=code_to_name, auto_create=not args.no_create,
+                                  chunksize=args.chunksize)
+        dt_ = time.perf_counter() - t0
+        print(f"{path}: {stats['rows']:,} rows, {stats['inserted']:,} new, {stats['updated']:,} updated, "
+              f"{stats['skipped']:,} skipped, {stats['unmatched']:,} unmatched, {stats['invalid']:,} invalid "
+              f"in {dt_:.2f}s ({_rate(stats['rows'], dt_)} rows)")
+        for k, v in stats.items():
+            totals[k] = totals.get(k, 0) + v
+    dt_ = time.perf_counter() - t_all
+    print(f"total: {len(files)} file(s), {totals['rows']:,} rows, {totals['inserted']:,} new, "
+          f"{totals['updated']:,} updated, {totals['created']:,} employees created "
+          f"in {dt_:.2f}s ({_rate(totals['rows'], dt_)} rows)")
+    return 0
+
+def cmd_payslips(engine, args) -> int:
+    from .payslip_batch import ingest_payslips
+
+    files = expand_inputs(args.paths, (".pdf", ".zip"))
+    if not files:
+        print("no PDF/zip files found", file=sys.stderr)
+        return 1
+
+    def read():
+        for path in files:
+            with open(path, "rb") as f:
+                yield path, f.read()
+
+    try:
+        report, stats = ingest_payslips(
+            engine, read(), workers=args.workers,
+            progress=lambda done, total: print(f"  parsed {done:,}/{total:,}", end="\r", file=sys.stderr, flush=True),
+        )
+    finally:
+        _done_progress()
+    for row in report[report["status"] == "error"].itertuples(index=False):
+        print(f"error {row.file}: {str(row.error).splitlines()[0]}", file=sys.stderr)
+    if args.report:
+        report.to_csv(args.report, index=False)
+    print(f"payslips: {stats['files']:,} file(s), {stats['saved']:,} saved ({stats['inserted']:,} new, "
+          f"{stats['updated']:,} updated), {stats['failed']:,} failed, {stats['created']:,} employees created "
+          f"in {stats['seconds']:.2f}s ({stats['files_per_sec']:,} files/s)")
+    return 1 if stats["failed"] else 0
+
+def cmd_consolidated(engine, args) -> int:
+    import pandas as pd
+    from .matching import load_aliases, match_consolidated_names, save_aliases
+    from .pdf_ingest import parse_consolidated
+
+    files = expand_inputs(args.paths, (".pdf",))
+    if not files:
+        print("no PDF files found", file=sys.stderr)
+        return 1
+    if args.write and not (args.month and args.year):
+        print("--write needs --month and --year", file=sys.stderr)
+        return 2
+    with engine.connect() as conn:
+        emp_df = pd.DataFrame([tuple(r) for r in conn.exec_driver_sql(
+            "SELECT id, code, first_name, last_name FROM employees").fetchall()],
+            columns=["id", "code", "first_name", "last_name"])
+        aliases = load_aliases(conn)
+
+    frames, t_all, pages_seen = [], time.perf_counter(), 0
+    for path in files:
+        t0 = time.perf_counter()
+        pages = [0]
+        with open(path, "rb") as f:
+            df = parse_consolidated(f.read(), progress=lambda page, total, rows: pages.__setitem__(0, total))
+        matched = match_consolidated_names(df, emp_df, aliases=aliases) if not df.empty else df
+        dt_ = time.perf_counter() - t0
+        pages_seen += pages[0]
+        kinds = matched["match_type"].value_counts().to_dict() if not matched.empty else {}
+        print(f"{path}: {pages[0]} page(s), {len(df):,} rows {kinds} in {dt_:.2f}s ({_rate(pages[0], dt_)} pages)")
+        frames.append(matched.assign(file=path))
+    out = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    if args.out:
+        out.to_csv(args.out, index=False)
+
+    if args.write and not out.empty:
+        from .cache import touch
+        from .payroll import upsert_payslips
+        from .payslip_batch import resolve_runs
+
+        ok = out[out["emp_id"].notna()]
+        net = ok["net"].fillna(0.0).astype(float)
+        with engine.begin() as conn:
+            run_id = resolve_runs(conn, [(args.month, args.year)])[(args.month, args.year)]
+            inserted, updated = upsert_payslips(conn, run_id, args.year, args.month,
+                                                zip(ok["emp_id"].astype(int), net, [0.0] * len(ok), net, [None] * len(ok)))
+            fz = ok[ok["match_type"] == "fuzzy"]
+            save_aliases(conn, zip(fz["name"], fz["emp_id"]), source="confirmed")
+            touch(conn, "payroll_runs", "payslips", "payroll_monthly", "name_aliases")
+        print(f"run {args.month:02d}/{args.year}: {inserted:,} payslips inserted, {updated:,} updated")
+    dt_ = time.perf_counter() - t_all
+    print(f"total: {len(files)} file(s), {pages_seen:,} pages, {len(out):,} rows "
+          f"in {dt_:.2f}s ({_rate(len(out), dt_)} rows)")
+    return 0
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m lib.cli", description="Headless INET HRMS batch processing.")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("payroll", help="run (or resume/recompute) payroll for one or more periods")
+    p.add_argument("periods", nargs="+", type=period, metavar="YYYY-MM")
+    p.add_argument("--merged", action="store_true", help="one multi-page run document per period")
+    p.add_argument("--workers", type=int, default=None, help="render processes (default: PDF_WORKERS / CPUs)")
+    p.set_defaults(fn=cmd_payroll)
+
+    p = sub.add_parser("attendance", help="import attendance CSVs")
+    p.add_argument("paths", nargs="+", help="CSV files, directories or globs")
+    p.add_argument("--map", help="code,name CSV used to name auto-created employees")
+    p.add_argument("--no-create", action="store_true", help="skip unknown codes instead of creating employees")
+    p.add_argument("--chunksize", type=int, default=100_000)
+    p.set_defaults(fn=cmd_attendance)
+
+    p = sub.add_parser("payslips", help="ingest payslip PDFs / zips of PDFs")
+    p.add_argument("paths", nargs="+", help="PDF/zip files, directories or globs")
+    p.add_argument("--workers", type=int, default=None, help="parse processes (default: PARSE_WORKERS / CPUs)")
+    p.add_argument("--report", help="write the per-file report CSV here")
+    p.set_defaults(fn=cmd_payslips)
+
+    p = sub.add_parser("consolidated", help="parse + match consolidated statements")
+    p.add_argument("paths", nargs="+", help="PDF files, directories or globs")
+    p.add_argument("--out", help="write matched rows CSV here")
+    p.add_argument("--write", action="store_true", help="upsert matched rows as payslips of --month/--year")
+    p.add_argument("--month", type=int)
+    p.add_argument("--year", type=int)
+    p.set_defaults(fn=cmd_consolidated)
+
+    args = ap.parse_args(argv)
+    from .db import bootstrap, engine
+    bootstrap()
+    return args.fn(engine, args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,83 +1,96 @@
-import streamlit as st
-from sqlalchemy import create_engine, text
+import os
+import sys
+import threading
+from sqlalchemy import create_engine, event, text
 from contextlib import contextmanager
 
-# Use Neon Postgres if provided; fallback to local SQLite for quick testing.
-PG_URL = st.secrets.get("postgres", {}).get("url")
+def _secrets_url():
+    if "streamlit" in sys.modules:
+        import streamlit as st
+        return st.secrets.get("postgres", {}).get("url")
+    # headless (python -m lib.cli, cron): read the same secrets file without importing streamlit
+    path = os.path.join(".streamlit", "secrets.toml")
+    if not os.path.exists(path):
+        return None
+    try:
+        import tomllib
+    except ImportError:  # Python < 3.11: set DATABASE_URL instead
+        return None
+    with open(path, "rb") as f:
+        return tomllib.load(f).get("postgres", {}).get("url")
+
+# Use Neon Postgres if provided (DATABASE_URL or [postgres] url in secrets);
+# fallback to local SQLite for quick testing.
+PG_URL = os.getenv("DATABASE_URL") or _secrets_url()
 DB_URL = PG_URL or "sqlite+pysqlite:///hrms.db"
 
-engine = create_engine(DB_URL, pool_pre_ping=True, future=True)
+# SQLite fallback: WAL lets readers keep going while a payroll run or import
+# holds its write transaction (rollback-journal mode locks them out), and
+# synchronous=NORMAL is durable in WAL except for the last commits on power loss.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-65536")),  # negative = KiB, i.e. 64 MiB per connection
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "30000")),
+}
+# Postgres pool: every Streamlit session, background job thread and upload
+# worker checks connections out of it. Neon drops idle connections, so
+# recycle well under its idle timeout (pool_pre_ping covers the rest).
+PG_POOL = {
+    "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+    "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "300")),
+    "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "30")),
+}
+
+def make_engine(url: str, pragmas=None):
+    """
+    Engine with the dialect's connection setup: SQLITE_PRAGMAS (or `pragmas`)
+    run on every new SQLite connection; Postgres gets the PG_POOL settings.
+    """
+    if not url.startswith("sqlite"):
+        return create_engine(url, pool_pre_ping=True, future=True, **PG_POOL)
+    eng = create_engine(url, pool_pre_ping=True, future=True)
+    pragmas = SQLITE_PRAGMAS if pragmas is None else pragmas
+
+    @event.listens_for(eng, "connect")
+    def _set_pragmas(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        for name, value in pragmas.items():
+            cur.execute(f"PRAGMA {name}={value}")
+        cur.close()
+    return eng
+
+engine = make_engine(DB_URL)
 
 @contextmanager
 def db() :
     with engine.begin() as conn:
         yield conn
 
-def _ddl_postgres():
-    return """
-    CREATE TABLE IF NOT EXISTS employees(
-      id SERIAL PRIMARY KEY,
-      code TEXT UNIQUE NOT NULL,
-      first_name TEXT, last_name TEXT,
-      base_salary NUMERIC NOT NULL DEFAULT 20000,
-      active BOOLEAN NOT NULL DEFAULT TRUE
-    );
-    CREATE TABLE IF NOT EXISTS attendance_logs(
-      id SERIAL PRIMARY KEY,
-      employee_id INT REFERENCES employees(id),
-      day DATE NOT NULL,
-      punch_in TIMESTAMP NULL,
-      punch_out TIMESTAMP NULL,
-      source TEXT
-    );
-    CREATE TABLE IF NOT EXISTS payroll_runs(
-      id SERIAL PRIMARY KEY,
-      month INT NOT NULL, year INT NOT NULL,
-      status TEXT, processed_on TIMESTAMP DEFAULT NOW()
-    );
-    CREATE TABLE IF NOT EXISTS payslips(
-      id SERIAL PRIMARY KEY,
-      run_id INT REFERENCES payroll_runs(id),
-      employee_id INT REFERENCES employees(id),
-      gross NUMERIC, deductions NUMERIC, net NUMERIC,
-      url TEXT
-    );
-    """
+_bootstrapped = False
+_bootstrap_lock = threading.Lock()
 
-def _ddl_sqlite():
-    return """
-    CREATE TABLE IF NOT EXISTS employees(
-      id INTEGER PRIMARY KEY AUTOINCREMENT,
-      code TEXT UNIQUE NOT NULL,
-      first_name TEXT, last_name TEXT,
-      base_salary REAL NOT NULL DEFAULT 20000,
-      active INTEGER NOT NULL DEFAULT 1
-    );
-    CREATE TABLE IF NOT EXISTS attendance_logs(
-      id INTEGER PRIMARY KEY AUTOINCREMENT,
-      employee_id INTEGER,
-      day TEXT NOT NULL,
-      punch_in TEXT, punch_out TEXT, source TEXT
-    );
-    CREATE TABLE IF NOT EXISTS payroll_runs(
-      id INTEGER PRIMARY KEY AUTOINCREMENT,
-      month INTEGER NOT NULL, year INTEGER NOT NULL,
-      status TEXT, processed_on TEXT
-    );
-    CREATE TABLE IF NOT EXISTS payslips(
-      id INTEGER PRIMARY KEY AUTOINCREMENT,
-      run_id INTEGER, employee_id INTEGER,
-      gross REAL, deductions REAL, net REAL, url TEXT
-    );
+def bootstrap():
+    """
+    ensure_schema + seed_if_empty once per process. Streamlit reruns the app
+    script on every interaction; lib modules stay imported, so this guard
+    keeps DDL and the seed COUNT(*) off the per-click path.
     """
+    global _bootstrapped
+    if _bootstrapped:
+        return
+    with _bootstrap_lock:
+        if not _bootstrapped:
+            ensure_schema()
+            seed_if_empty()
+            _bootstrapped = True
 
 def ensure_schema():
-    ddl = _ddl_sqlite() if engine.dialect.name == "sqlite" else _ddl_postgres()
-    with db() as conn:
-        for stmt in ddl.split(";"):
-            s = stmt.strip()
-            if s:
-                conn.exec_driver_sql(s + ";")
+    """Bring the database up to the latest schema version (see lib/migrations.py)."""
+    from .migrations import migrate
+    migrate(engine)
 
 def seed_if_empty():
     with db() as conn:
@@ -95,3 +108,76 @@ def seed_if_empty():
             ('E004','Neha','Rao',26000),
             ('E005','Vikram','Shah',30000);
             """)
+        if not conn.exec_driver_sql("SELECT COUNT(*) FROM statutory_rules").scalar():
+            from .statutory import DEFAULT_RULES
+            bulk_insert(conn, "statutory_rules", ("component", "kind", "lo", "hi", "value"), DEFAULT_RULES)
+
+def insert_returning_id(conn, table: str, columns, values) -> int:
+    """
+    Insert one row and return its id from the same statement (no SELECT max(id)).
+    """
+    p = "?" if conn.dialect.name == "sqlite" else "%s"
+    marks = ",".join([p] * len(columns))
+    return conn.exec_driver_sql(
+        f"INSERT INTO {table}({','.join(columns)}) VALUES ({marks}) RETURNING id",
+        tuple(values),
+    ).scalar()
+
+def bulk_insert(conn, table: str, columns, rows, suffix: str = "") -> int:
+    """
+    Insert many rows in one batched statement: executemany on SQLite,
+    multi-VALUES (psycopg2 execute_values) on Postgres.
+    `suffix` is appended after VALUES (e.g. an ON CONFLICT clause).
+    Returns the number of rows written.
+    """
+    rows = [tuple(r) for r in rows]
+    if not rows:
+        return 0
+    cols = ",".join(columns)
+    if conn.dialect.name == "sqlite":
+        marks = ",".join(["?"] * len(columns))
+        conn.exec_driver_sql(f"INSERT INTO {table}({cols}) VALUES ({marks}) {suffix}", rows)
+    else:
+        from psycopg2.extras import execute_values
+        cur = conn.connection.cursor()
+        execute_values(cur, f"INSERT INTO {table}({cols}) VALUES %s {suffix}", rows, page_size=1000)
+    return len(rows)
+
+def bulk_insert_returning(conn, table: str, columns, rows, returning: str = "id", batch: int = 500):
+    """
+    Multi-VALUES INSERT ... RETURNING in batches (one round trip per `batch` rows).
+    Returns the RETURNING rows in insert order.
+    """
+    rows = [tuple(r) for r in rows]
+    p = "?" if conn.dialect.name == "sqlite" else "%s"
+    one = "(" + ",".join([p] * len(columns)) + ")"
+    out = []
+    for i in range(0, len(rows), batch):
+        part = rows[i:i + batch]
+        params = tuple(v for r in part for v in r)
+        out += conn.exec_driver_sql(
+            f"INSERT INTO {table}({','.join(columns)}) VALUES {','.join([one] * len(part))} RETURNING {returning}",
+            params,
+        ).fetchall()
+    return out
+
+def copy_rows(conn, table: str, columns, df) -> int:
+    """
+    Bulk-load a DataFrame (columns in `columns` order): COPY FROM STDIN on
+    Postgres, executemany on SQLite. NaN/None become NULL.
+    """
+    if df.empty:
+        return 0
+    df = df[list(columns)]
+    if conn.dialect.name == "sqlite":
+        rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+        marks = ",".join(["?"] * len(columns))
+        conn.exec_driver_sql(f"INSERT INTO {table}({','.join(columns)}) VALUES ({marks})", list(rows))
+    else:
+        from io import StringIO
+        buf = StringIO()
+        df.to_csv(buf, header=False, index=False)
+        buf.seek(0)
+        cur = conn.connection.cursor()
+        cur.copy_expert(f"COPY {table}({','.join(columns)}) FROM STDIN WITH (FORMAT csv)", buf)
+    return len(df)
@@ -0,0 +1,241 @@
+# lib/jobs.py
+"""
+Local background jobs for long work (payroll runs, attendance imports).
+
+Jobs are rows in the `jobs` table and run on a process-wide thread pool
+(JOB_WORKERS), so they outlive the Streamlit session that submitted them
+and several can be queued at once. Pages submit() and then poll get_job()
+/ list_jobs(); cancel() is cooperative: handlers see it at their next
+progress() call, which every handler makes after each committed batch.
+Each server process heartbeats the jobs it is running; a 'running' job whose
+heartbeat goes stale (its process died) is failed by whichever server notices.
+"""
+from __future__ import annotations
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from .db import insert_returning_id
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_HEARTBEAT = float(os.getenv("JOB_HEARTBEAT", "15"))  # seconds between heartbeats
+JOB_STALE = float(os.getenv("JOB_STALE", "120"))  # a running job silent this long is presumed dead
+OWNER = f"{socket.gethostname()}:{os.getpid()}"
+SPOOL_DIR = os.path.join("data", "jobs")  # uploaded inputs wait here until their job runs
+ACTIVE = ("queued", "running")
+JOB_COLUMNS = ["id", "kind", "status", "progress", "message", "error", "result",
+               "created_at", "started_at", "finished_at"]
+
+class JobCancelled(Exception):
+    pass
+
+class JobContext:
+    """Handed to handlers: report progress and pick up cancellation."""
+
+    def __init__(self, engine, job_id: int):
+        self.engine, self.job_id = engine, job_id
+
+    def progress(self, fraction: Optional[float] = None, message: Optional[str] = None) -> None:
+        p = _p(self.engine)
+        with self.engine.begin() as conn:
+            cancel = conn.exec_driver_sql(
+                f"UPDATE jobs SET progress = COALESCE({p}, progress), message = COALESCE({p}, message), "
+                f"heartbeat_at = CURRENT_TIMESTAMP WHERE id = {p} RETURNING cancel_requested",
+                (fraction, message, self.job_id),
+            ).scalar()
+        if cancel:
+            raise JobCancelled()
+
+_HANDLERS: Dict[str, Callable[[Any, Dict, JobContext], Dict]] = {}
+
+def job(kind: str):
+    """Register handler(engine, params, ctx) -> result dict for `kind`."""
+    def register(fn):
+        _HANDLERS[kind] = fn
+        return fn
+    return register
+
+def _p(engine) -> str:
+    return "?" if engine.dialect.name == "sqlite" else "%s"
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+def _get_pool(engine) -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+                _recover(engine, _pool)
+                threading.Thread(target=_heartbeat, args=(engine,), name="job-heartbeat", daemon=True).start()
+    return _pool
+
+def _fail_stale(conn) -> None:
+    # running jobs whose owner stopped heartbeating; other servers' live jobs are left alone
+    if conn.dialect.name == "sqlite":
+        stale = f"datetime('now', '-{int(JOB_STALE)} seconds')"
+    else:
+        stale = f"CURRENT_TIMESTAMP - INTERVAL '{int(JOB_STALE)} seconds'"
+    conn.exec_driver_sql(
+        "UPDATE jobs SET status = 'failed', error = 'interrupted: its server process stopped; submit it again', "
+        f"finished_at = CURRENT_TIMESTAMP WHERE status = 'running' AND COALESCE(heartbeat_at, started_at) < {stale}"
+    )
+
+def _recover(engine, pool) -> None:
+    # fail what a dead process was running, pick queued jobs back up
+    with engine.begin() as conn:
+        _fail_stale(conn)
+        queued = [r[0] for r in conn.exec_driver_sql("SELECT id FROM jobs WHERE status = 'queued' ORDER BY id")]
+    for job_id in queued:
+        pool.submit(_execute, engine, job_id)
+
+def _heartbeat(engine) -> None:
+    p = _p(engine)
+    while True:
+        time.sleep(JOB_HEARTBEAT)
+        try:
+            with engine.begin() as conn:
+                conn.exec_driver_sql(
+                    f"UPDATE jobs SET heartbeat_at = CURRENT_TIMESTAMP WHERE owner = {p} AND status = 'running'", (OWNER,))
+                _fail_stale(conn)
+        except Exception:  # a busy or unreachable database must not kill the heartbeat
+            traceback.print_exc()
+
+def _finish(engine, job_id: int, status: str, result=None, error: Optional[str] = None) -> None:
+    p = _p(engine)
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            f"UPDATE jobs SET status = {p}, result = {p}, error = {p}, "
+            f"message = COALESCE({p}, message), progress = CASE WHEN {p} = 'succeeded' THEN 1 ELSE progress END, "
+            f"finished_at = CURRENT_TIMESTAMP WHERE id = {p}",
+            (status, json.dumps(result) if result is not None else None, error,
+             (result or {}).get("summary"), status, job_id),
+        )
+
+def _execute(engine, job_id: int) -> None:
+    p = _p(engine)
+    with engine.begin() as conn:
+        row = conn.exec_driver_sql(
+            f"UPDATE jobs SET status = 'running', started_at = CURRENT_TIMESTAMP, heartbeat_at = CURRENT_TIMESTAMP, "
+            f"owner = {p} WHERE id = {p} AND status = 'queued' RETURNING kind, params",
+            (OWNER, job_id),
+        ).first()
+    if row is None:  # cancelled while queued
+        return
+    kind, params = row
+    try:
+        result = _HANDLERS[kind](engine, json.loads(params or "{}"), JobContext(engine, job_id))
+    except JobCancelled:
+        _finish(engine, job_id, "cancelled")
+    except Exception as e:
+        _finish(engine, job_id, "failed", error=f"{type(e).__name__}: {e}\n{traceback.format_exc(limit=5)}")
+    else:
+        _finish(engine, job_id, "succeeded", result=result)
+
+def submit(engine, kind: str, params: Optional[Dict] = None) -> int:
+    """Queue a job and return its id; it starts as soon as a worker is free."""
+    if kind not in _HANDLERS:
+        raise ValueError(f"unknown job kind: {kind}")
+    with engine.begin() as conn:
+        job_id = insert_returning_id(conn, "jobs", ("kind", "params", "status", "progress"),
+                                     (kind, json.dumps(params or {}), "queued", 0.0))
+    _get_pool(engine).submit(_execute, engine, job_id)
+    return job_id
+
+def cancel(engine, job_id: int) -> None:
+    """Queued jobs are cancelled at once; running ones stop at their next progress report."""
+    _get_pool(engine)  # settles rows left 'running' by a dead server process first
+    p = _p(engine)
+    with engine.begin() as conn:
+        row = conn.exec_driver_sql(
+            f"UPDATE jobs SET cancel_requested = 1, "
+            f"status = CASE WHEN status = 'queued' THEN 'cancelled' ELSE status END, "
+            f"finished_at = CASE WHEN status = 'queued' THEN CURRENT_TIMESTAMP ELSE finished_at END "
+            f"WHERE id = {p} AND status IN ('queued', 'running') RETURNING status, params",
+            (job_id,),
+        ).first()
+    # a job cancelled before it ran never reaches the handler that deletes its upload
+    if row is not None and row[0] == "cancelled":
+        path = json.loads(row[1] or "{}").get("path")
+        if path and os.path.exists(path):
+            os.remove(path)
+
+def _row(r) -> Dict:
+    d = dict(zip(JOB_COLUMNS, r))
+    d["result"] = json.loads(d["result"]) if d["result"] else None
+    return d
+
+def get_job(engine, job_id: int) -> Optional[Dict]:
+    _get_pool(engine)
+    with engine.connect() as conn:
+        r = conn.exec_driver_sql(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = {_p(engine)}", (job_id,)).first()
+    return _row(r) if r else None
+
+def list_jobs(engine, kinds: Optional[List[str]] = None, limit: int = 20) -> List[Dict]:
+    """
+    Most recent jobs first, optionally only the given kinds. The first call in
+    a server process (pages poll this) also recovers jobs left by dead ones.
+    """
+    _get_pool(engine)
+    p = _p(engine)
+    where = f"WHERE kind IN ({','.join([p] * len(kinds))})" if kinds else ""
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql(
+            f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs {where} ORDER BY id DESC LIMIT {int(limit)}",
+            tuple(kinds or ()),
+        ).fetchall()
+    return [_row(r) for r in rows]
+
+def spool(data: bytes, suffix: str = "") -> str:
+    """Persist an uploaded input for a job; the handler (or cancel()) deletes it when done."""
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    path = os.path.join(SPOOL_DIR, uuid.uuid4().hex + suffix)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+# ---- handlers ----
+
+@job("payroll")
+def _payroll_job(engine, params: Dict, ctx: JobContext) -> Dict:
+    from .payroll import run_payroll
+
+    month, year = int(params["month"]), int(params["year"])
+    ctx.progress(0.0, f"Computing payroll {month:02d}/{year}")
+    results = run_payroll(
+        engine, month, year, merged=bool(params.get("merged")),
+        progress=lambda done, total: ctx.progress(done / total if total else 1.0,
+                                                  f"{done:,}/{total:,} payslips rendered & stored"),
+    )
+    redone = sum(r["rendered"] for r in results)
+    reused = sum(r["reused"] for r in results if r["rendered"])
+    return {"month": month, "year": year, "employees": len(results), "rendered": redone, "reused": reused,
+            "summary": f"{len(results):,} employees · {redone:,} recomputed ({redone - reused:,} uploaded, "
+                       f"{reused:,} identical PDFs already stored), {len(results) - redone:,} already current"}
+
+@job("attendance")
+def _attendance_job(engine, params: Dict, ctx: JobContext) -> Dict:
+    from .attendance import import_attendance
+
+    path = params["path"]
+    size = os.path.getsize(path) or 1
+    try:
+        with open(path, "rb") as f:
+            stats = import_attendance(
+                engine, f, code_to_name=params.get("code_to_name") or {},
+                auto_create=bool(params.get("auto_create", True)),
+                progress=lambda s: ctx.progress(min(f.tell() / size, 1.0),
+                                                f"Read {s['rows']:,} rows · {s['inserted']:,} new, {s['updated']:,} updated"),
+            )
+    finally:
+        os.remove(path)
+    stats["summary"] = (f"{stats['inserted']:,} new, {stats['updated']:,} updated, {stats['skipped']:,} skipped · "
+                        f"{stats['invalid']:,} unparseable · {stats['created']:,} employees created, {stats['missing']:,} unknown codes")
+    return stats
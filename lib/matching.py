@@ -1,7 +1,9 @@
 # lib/matching.py
+import math
 import re
+from collections import Counter, defaultdict
 from difflib import SequenceMatcher
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple
 import pandas as pd
 
 def _norm(s: str) -> str:
@@ -23,58 +25,181 @@ def best_match(needle: str, haystack: List[str], threshold: float = 0.86) -> Tup
             best, score = h, r
     return (best, score) if score >= threshold else ("", 0.0)
 
+def _trigrams(s: str) -> Counter:
+    return Counter(s[i:i + 3] for i in range(len(s) - 2))
+
+def _min_matches(total: int, threshold: float) -> int:
+    # smallest M with SequenceMatcher's 2.0*M/total >= threshold
+    m = max(0, math.ceil(threshold * total / 2) - 1)
+    while 2.0 * m / total < threshold:
+        m += 1
+    return m
+
+class NameIndex:
+    """
+    Blocking index over normalized employee names that gives the same answer
+    as best_match() over the whole pool, without scoring every name.
+
+    - exact hits come from a hash map;
+    - a candidate of length lb can only reach `threshold` against a needle of
+      length la if 2*min(la, lb)/(la+lb) >= threshold (length pruning);
+    - a ratio needs M matched characters in k blocks, k <= 1 + (la+lb-2M), and
+      every block of length L shares L-2 trigrams, so candidates must share at
+      least 5M - 2 - 2(la+lb) trigrams (character-trigram inverted index);
+    - survivors are scored with SequenceMatcher(None, needle, name), highest
+      bound first, until no remaining bound can beat the best score.
+
+    Only candidates that provably cannot reach the threshold are skipped, so
+    ties and scores match the exhaustive scan exactly.
+    """
+
+    def __init__(self, names: List[str], threshold: float = 0.86):
+        self.threshold = threshold
+        self.first: Dict[str, int] = {}       # name -> first position in the pool
+        for i, n in enumerate(names):
+            self.first.setdefault(n, i)
+        self.names = list(self.first)          # unique names, pool order
+        self.by_len: Dict[int, List[int]] = defaultdict(list)
+        self.postings: Dict[Tuple[int, str], List[Tuple[int, int]]] = defaultdict(list)
+        for u, n in enumerate(self.names):
+            self.by_len[len(n)].append(u)
+            for g, c in _trigrams(n).items():
+                self.postings[(len(n), g)].append((u, c))
+
+    def _candidates(self, needle: str) -> List[Tuple[float, int]]:
+        """(ratio upper bound, unique position) for every name that may reach the threshold."""
+        la, t = len(needle), self.threshold
+        grams = _trigrams(needle)
+        out = []
+        for lb, members in self.by_len.items():
+            total = la + lb
+            if not total or 2.0 * min(la, lb) / total < t:
+                continue
+            need = 5 * _min_matches(total, t) - 2 - 2 * total
+            shared: Dict[int, int] = dict.fromkeys(members, 0) if need <= 0 else defaultdict(int)
+            for g, c in grams.items():
+                for u, cu in self.postings.get((lb, g), ()):
+                    shared[u] += min(c, cu)
+            for u, n in shared.items():
+                if n >= need:
+                    # invert the trigram bound: M <= (shared + 2 + 2*total) / 5
+                    m = min(la, lb, (n + 2 + 2 * total) // 5)
+                    out.append((2.0 * m / total, u))
+        out.sort(key=lambda c: (-c[0], c[1]))
+        return out
+
+    def best(self, needle: str) -> Tuple[Optional[int], str, float]:
+        """(pool position, match_type, score) for one normalized needle."""
+        if needle in self.first:
+            return self.first[needle], "exact", 1.0
+        sm = SequenceMatcher(None)
+        sm.set_seq1(needle)
+        best_u, score = None, 0.0
+        # most promising first; stop once no remaining bound can reach the best so far
+        for bound, u in self._candidates(needle):
+            floor = max(score, self.threshold)
+            if bound < floor:
+                break
+            sm.set_seq2(self.names[u])
+            if sm.quick_ratio() < floor:
+                continue
+            r = sm.ratio()
+            # equal scores go to the earlier pool position, as in best_match
+            if r > score or (r == score and best_u is not None and u < best_u):
+                best_u, score = u, r
+        if best_u is None or score < self.threshold:
+            return None, "unmatched", 0.0
+        return self.first[self.names[best_u]], "fuzzy", score
+
+# ---- learned aliases ----
+# name_aliases maps a normalized statement name to the employee it belongs to.
+# Rows come from confirmed fuzzy matches and from corrected "unmatched" CSVs,
+# so a spelling only ever has to be resolved once.
+
+def load_aliases(conn) -> Dict[str, int]:
+    return {a: int(e) for a, e in conn.exec_driver_sql("SELECT alias, employee_id FROM name_aliases")}
+
+def save_aliases(conn, pairs, source: str = "manual") -> int:
+    """Upsert (statement name, employee_id) pairs; names are normalized here. Returns rows written."""
+    from .db import bulk_insert
+
+    rows = {}
+    for name, emp_id in pairs:
+        alias = _norm(str(name))
+        if alias and emp_id is not None and not pd.isna(emp_id):
+            rows[alias] = (alias, int(emp_id), source)
+    now = "CURRENT_TIMESTAMP" if conn.dialect.name == "sqlite" else "now()"
+    return bulk_insert(
+        conn, "name_aliases", ("alias", "employee_id", "source"), list(rows.values()),
+        suffix=f"ON CONFLICT(alias) DO UPDATE SET employee_id=excluded.employee_id, "
+               f"source=excluded.source, updated_at={now}",
+    )
+
+def corrected_aliases(df_corrected: pd.DataFrame, df_employees: pd.DataFrame) -> Tuple[List[Tuple[str, int]], List[str]]:
+    """
+    Read a corrected unmatched CSV (the preview download with emp_id, or a
+    `code` column, filled in). Returns ((name, employee_id) pairs, problems).
+    """
+    ids = set(int(i) for i in df_employees["id"])
+    by_code = {str(c).strip().upper(): int(i) for i, c in zip(df_employees["id"], df_employees["code"])}
+    pairs, problems = [], []
+    for n, row in enumerate(df_corrected.to_dict("records"), start=2):  # line 1 is the header
+        name = row.get("name")
+        emp_id, code = row.get("emp_id"), row.get("code")
+        if isinstance(name, float) or not str(name or "").strip():
+            continue
+        if code is not None and not pd.isna(code) and str(code).strip():
+            emp_id = by_code.get(str(code).strip().upper())
+            if emp_id is None:
+                problems.append(f"line {n}: unknown code {code!r}")
+                continue
+        if emp_id is None or pd.isna(emp_id) or str(emp_id).strip() == "":
+            continue  # left blank: still unmatched
+        try:
+            emp_id = int(float(emp_id))
+        except ValueError:
+            problems.append(f"line {n}: bad emp_id {emp_id!r}")
+            continue
+        if emp_id not in ids:
+            problems.append(f"line {n}: unknown emp_id {emp_id}")
+            continue
+        pairs.append((str(name), emp_id))
+    return pairs, problems
+
 def match_consolidated_names(
-    df_consol: pd.DataFrame, df_employees: pd.DataFrame, threshold: float = 0.86
+    df_consol: pd.DataFrame, df_employees: pd.DataFrame, threshold: float = 0.86,
+    aliases: Optional[Dict[str, int]] = None,
 ) -> pd.DataFrame:
+    """
+    Resolve each statement row to an employee: learned alias first (O(1)),
+    then exact normalized name, then NameIndex fuzzy scoring.
+    """
     df = df_consol.copy()
     df_employees = df_employees.fillna("")
-    df_employees["full_norm"] = df_employees.apply(
-        lambda r: _full(r["first_name"], r["last_name"]), axis=1
-    )
-    pool = df_employees["full_norm"].tolist()
+    full_norm = [_full(f, l) for f, l in zip(df_employees["first_name"], df_employees["last_name"])]
+    index = NameIndex(full_norm, threshold)
+    ids = df_employees["id"].tolist()
+    display = [f"{f} {l}".strip() for f, l in zip(df_employees["first_name"], df_employees["last_name"])]
+    pos_of = {int(i): n for n, i in enumerate(ids)}
+    aliases = aliases or {}
 
     out = []
-    for _, row in df.iterrows():
+    for row in df.to_dict("records"):
         raw_name = str(row.get("name", ""))
         needle = _norm(raw_name)
-
-        exact = df_employees[df_employees["full_norm"] == needle]
-        if not exact.empty:
-            r = exact.iloc[0]
-            out.append({
-                "name": raw_name,
-                "designation": row.get("designation"),
-                "wage_rate": row.get("wage_rate"),
-                "net": row.get("net"),
-                "emp_id": int(r["id"]),
-                "emp_name": f"{r['first_name']} {r['last_name']}".strip(),
-                "match_type": "exact",
-                "score": 1.0
-            })
-            continue
-
-        best, score = best_match(needle, pool, threshold)
-        if best:
-            r = df_employees[df_employees["full_norm"] == best].iloc[0]
-            out.append({
-                "name": raw_name,
-                "designation": row.get("designation"),
-                "wage_rate": row.get("wage_rate"),
-                "net": row.get("net"),
-                "emp_id": int(r["id"]),
-                "emp_name": f"{r['first_name']} {r['last_name']}".strip(),
-                "match_type": "fuzzy",
-                "score": round(float(score), 4)
-            })
+        pos = pos_of.get(aliases.get(needle, -1))
+        if pos is not None:
+            kind, score = "alias", 1.0
         else:
-            out.append({
-                "name": raw_name,
-                "designation": row.get("designation"),
-                "wage_rate": row.get("wage_rate"),
-                "net": row.get("net"),
-                "emp_id": None,
-                "emp_name": "",
-                "match_type": "unmatched",
-                "score": 0.0
-            })
+            pos, kind, score = index.best(needle)
+        out.append({
+            "name": raw_name,
+            "designation": row.get("designation"),
+            "wage_rate": row.get("wage_rate"),
+            "net": row.get("net"),
+            "emp_id": int(ids[pos]) if pos is not None else None,
+            "emp_name": display[pos] if pos is not None else "",
+            "match_type": kind,
+            "score": round(float(score), 4) if kind == "fuzzy" else score,
+        })
     return pd.DataFrame(out)
@@ -0,0 +1,417 @@
+# lib/migrations.py
+"""
+Versioned, forward-only schema migrations.
+
+Each step is (version, name, {dialect: [statement | callable(conn)]}) and runs
+in its own transaction; applied versions are recorded in schema_migrations.
+Add new steps at the end of MIGRATIONS, never edit one that has shipped.
+"""
+from __future__ import annotations
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+def _baseline_postgres():
+    return """
+    CREATE TABLE IF NOT EXISTS employees(
+      id SERIAL PRIMARY KEY,
+      code TEXT UNIQUE NOT NULL,
+      first_name TEXT, last_name TEXT,
+      base_salary NUMERIC NOT NULL DEFAULT 20000,
+      active BOOLEAN NOT NULL DEFAULT TRUE
+    );
+    CREATE TABLE IF NOT EXISTS attendance_logs(
+      id SERIAL PRIMARY KEY,
+      employee_id INT REFERENCES employees(id),
+      day DATE NOT NULL,
+      punch_in TIMESTAMP NULL,
+      punch_out TIMESTAMP NULL,
+      source TEXT
+    );
+    CREATE TABLE IF NOT EXISTS payroll_runs(
+      id SERIAL PRIMARY KEY,
+      month INT NOT NULL, year INT NOT NULL,
+      status TEXT, processed_on TIMESTAMP DEFAULT NOW()
+    );
+    CREATE TABLE IF NOT EXISTS payslips(
+      id SERIAL PRIMARY KEY,
+      run_id INT REFERENCES payroll_runs(id),
+      employee_id INT REFERENCES employees(id),
+      gross NUMERIC, deductions NUMERIC, net NUMERIC,
+      url TEXT
+    );
+    CREATE TABLE IF NOT EXISTS statutory_rules(
+      id SERIAL PRIMARY KEY,
+      component TEXT NOT NULL, kind TEXT NOT NULL,
+      lo NUMERIC NULL, hi NUMERIC NULL, value NUMERIC NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS object_manifest(
+      key TEXT PRIMARY KEY,
+      digest TEXT NOT NULL,
+      size BIGINT,
+      stored_at TIMESTAMP DEFAULT NOW()
+    );
+    CREATE INDEX IF NOT EXISTS ix_object_manifest_digest ON object_manifest(digest);
+    CREATE UNLOGGED TABLE IF NOT EXISTS attendance_staging(
+      batch TEXT NOT NULL,
+      employee_id INT,
+      day DATE NOT NULL,
+      punch_in TIMESTAMP NULL,
+      punch_out TIMESTAMP NULL,
+      source TEXT
+    );
+    """
+
+def _baseline_sqlite():
+    return """
+    CREATE TABLE IF NOT EXISTS employees(
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      code TEXT UNIQUE NOT NULL,
+      first_name TEXT, last_name TEXT,
+      base_salary REAL NOT NULL DEFAULT 20000,
+      active INTEGER NOT NULL DEFAULT 1
+    );
+    CREATE TABLE IF NOT EXISTS attendance_logs(
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      employee_id INTEGER,
+      day TEXT NOT NULL,
+      punch_in TEXT, punch_out TEXT, source TEXT
+    );
+    CREATE TABLE IF NOT EXISTS payroll_runs(
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      month INTEGER NOT NULL, year INTEGER NOT NULL,
+      status TEXT, processed_on TEXT
+    );
+    CREATE TABLE IF NOT EXISTS payslips(
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      run_id INTEGER, employee_id INTEGER,
+      gross REAL, deductions REAL, net REAL, url TEXT
+    );
+    CREATE TABLE IF NOT EXISTS statutory_rules(
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      component TEXT NOT NULL, kind TEXT NOT NULL,
+      lo REAL, hi REAL, value REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS object_manifest(
+      key TEXT PRIMARY KEY,
+      digest TEXT NOT NULL,
+      size INTEGER,
+      stored_at TEXT DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS ix_object_manifest_digest ON object_manifest(digest);
+    CREATE TABLE IF NOT EXISTS attendance_staging(
+      batch TEXT NOT NULL,
+      employee_id INTEGER,
+      day TEXT NOT NULL,
+      punch_in TEXT, punch_out TEXT, source TEXT
+    );
+    """
+
+def _index_exists(conn, name: str) -> bool:
+    if conn.dialect.name == "sqlite":
+        sql = "SELECT 1 FROM sqlite_master WHERE type='index' AND name=?"
+    else:
+        sql = "SELECT 1 FROM pg_indexes WHERE indexname=%s"
+    return conn.exec_driver_sql(sql, (name,)).first() is not None
+
+def _ensure_attendance_key(conn):
+    # one-time: drop duplicate punches left by earlier re-imports, then enforce the key
+    if _index_exists(conn, "ux_attendance_emp_day_in"):
+        return
+    conn.exec_driver_sql("""
+        DELETE FROM attendance_logs WHERE id NOT IN (
+          SELECT MIN(id) FROM attendance_logs GROUP BY employee_id, day, punch_in
+        )
+    """)
+    conn.exec_driver_sql(
+        "CREATE UNIQUE INDEX ux_attendance_emp_day_in ON attendance_logs(employee_id, day, punch_in)"
+    )
+
+def _statements(ddl: str) -> List[str]:
+    return [s.strip() for s in ddl.split(";") if s.strip()]
+
+_V2_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_attendance_emp_day ON attendance_logs(employee_id, day)",
+    "CREATE INDEX IF NOT EXISTS ix_attendance_day ON attendance_logs(day)",
+    "CREATE INDEX IF NOT EXISTS ix_payslips_run ON payslips(run_id)",
+    "CREATE INDEX IF NOT EXISTS ix_payslips_employee ON payslips(employee_id)",
+    "CREATE INDEX IF NOT EXISTS ix_payroll_runs_period ON payroll_runs(year, month)",
+]
+
+# SQLite kept day/punch times as free TEXT. Rebuild attendance with day as
+# INTEGER days since 1970-01-01 and punches as INTEGER unix seconds, parsed in
+# Python with the importer's rules (lib.attendance._typed_times) so any format
+# the importer accepts converts. Rows that still do not parse, or collapse
+# onto an earlier punch, are kept verbatim in attendance_rejects with a reason
+# instead of being dropped. Postgres already has DATE/TIMESTAMP columns, so
+# it only gets the (empty) rejects table.
+_REJECTS_COLUMNS = ("id", "employee_id", "day", "punch_in", "punch_out", "source", "reason")
+
+def _v3_sqlite_typed_attendance(conn, chunk: int = 50_000):
+    import pandas as pd
+    from .attendance import _typed_times
+    from .db import bulk_insert
+
+    conn.exec_driver_sql("""
+        CREATE TABLE attendance_logs_v3(
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          employee_id INTEGER,
+          day INTEGER NOT NULL,
+          punch_in INTEGER, punch_out INTEGER, source TEXT
+        )
+    """)
+    conn.exec_driver_sql("CREATE UNIQUE INDEX ux_attendance_v3 ON attendance_logs_v3(employee_id, day, punch_in)")
+    last = 0
+    while True:
+        rows = conn.exec_driver_sql(
+            "SELECT id, employee_id, day, punch_in, punch_out, source FROM attendance_logs "
+            "WHERE id > ? ORDER BY id LIMIT ?", (last, chunk),
+        ).fetchall()
+        if not rows:
+            break
+        last = rows[-1][0]
+        df = pd.DataFrame([tuple(r) for r in rows], columns=list(_REJECTS_COLUMNS[:-1]))
+        typed, rejected = _typed_times(df, sqlite=True)
+        typed = typed.astype(object).where(typed.notna(), None)
+        bulk_insert(conn, "attendance_logs_v3", _REJECTS_COLUMNS[:-1], typed.itertuples(index=False, name=None),
+                    suffix="ON CONFLICT DO NOTHING")
+        kept = {i for (i,) in conn.exec_driver_sql(
+            "SELECT id FROM attendance_logs_v3 WHERE id BETWEEN ? AND ?", (rows[0][0], last))}
+        dup = df[df["id"].isin(set(typed["id"]) - kept)].assign(reason="duplicate of an earlier punch")
+        bad = pd.concat([rejected, dup]).astype(object)
+        bulk_insert(conn, "attendance_rejects", _REJECTS_COLUMNS,
+                    bad.where(bad.notna(), None).itertuples(index=False, name=None))
+    conn.exec_driver_sql("DROP TABLE attendance_logs")
+    conn.exec_driver_sql("ALTER TABLE attendance_logs_v3 RENAME TO attendance_logs")
+    conn.exec_driver_sql("DROP INDEX ux_attendance_v3")
+
+_V3_REJECTS = """
+    CREATE TABLE IF NOT EXISTS attendance_rejects(
+      id INTEGER PRIMARY KEY,
+      employee_id INTEGER,
+      day TEXT, punch_in TEXT, punch_out TEXT, source TEXT,
+      reason TEXT NOT NULL
+    )
+"""
+
+_V3_SQLITE_TYPED_ATTENDANCE = [
+    _V3_REJECTS,
+    _v3_sqlite_typed_attendance,
+    "CREATE UNIQUE INDEX ux_attendance_emp_day_in ON attendance_logs(employee_id, day, punch_in)",
+    "CREATE INDEX ix_attendance_emp_day ON attendance_logs(employee_id, day)",
+    "CREATE INDEX ix_attendance_day ON attendance_logs(day)",
+    "DROP TABLE IF EXISTS attendance_staging",
+    """
+    CREATE TABLE attendance_staging(
+      batch TEXT NOT NULL,
+      employee_id INTEGER,
+      day INTEGER NOT NULL,
+      punch_in INTEGER, punch_out INTEGER, source TEXT
+    )
+    """,
+]
+
+def _rollup_backfill(conn):
+    from .rollups import rebuild_rollups_conn
+    rebuild_rollups_conn(conn)
+
+_V4_ROLLUPS = {
+    "sqlite": [
+        "CREATE TABLE IF NOT EXISTS attendance_daily(day INTEGER PRIMARY KEY, punches INTEGER NOT NULL DEFAULT 0)",
+        """
+        CREATE TABLE IF NOT EXISTS payroll_monthly(
+          year INTEGER NOT NULL, month INTEGER NOT NULL,
+          payslips INTEGER NOT NULL DEFAULT 0,
+          gross REAL NOT NULL DEFAULT 0, deductions REAL NOT NULL DEFAULT 0, net REAL NOT NULL DEFAULT 0,
+          PRIMARY KEY(year, month)
+        )
+        """,
+        _rollup_backfill,
+    ],
+    "postgresql": [
+        "CREATE TABLE IF NOT EXISTS attendance_daily(day DATE PRIMARY KEY, punches INT NOT NULL DEFAULT 0)",
+        """
+        CREATE TABLE IF NOT EXISTS payroll_monthly(
+          year INT NOT NULL, month INT NOT NULL,
+          payslips INT NOT NULL DEFAULT 0,
+          gross NUMERIC NOT NULL DEFAULT 0, deductions NUMERIC NOT NULL DEFAULT 0, net NUMERIC NOT NULL DEFAULT 0,
+          PRIMARY KEY(year, month)
+        )
+        """,
+        _rollup_backfill,
+    ],
+}
+
+_V5_NAME_ALIASES = {
+    "sqlite": [
+        """
+        CREATE TABLE IF NOT EXISTS name_aliases(
+          alias TEXT PRIMARY KEY,
+          employee_id INTEGER NOT NULL REFERENCES employees(id) ON DELETE CASCADE,
+          source TEXT NOT NULL DEFAULT 'manual',
+          updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ],
+    "postgresql": [
+        """
+        CREATE TABLE IF NOT EXISTS name_aliases(
+          alias TEXT PRIMARY KEY,
+          employee_id INT NOT NULL REFERENCES employees(id) ON DELETE CASCADE,
+          source TEXT NOT NULL DEFAULT 'manual',
+          updated_at TIMESTAMP DEFAULT now()
+        )
+        """,
+    ],
+}
+
+def _ensure_payslip_key(conn):
+    # one-time: keep the latest payslip per (run, employee), enforce the key, re-derive totals
+    if _index_exists(conn, "ux_payslips_run_employee"):
+        return
+    conn.exec_driver_sql("""
+        DELETE FROM payslips WHERE id NOT IN (
+          SELECT MAX(id) FROM payslips GROUP BY run_id, employee_id
+        )
+    """)
+    conn.exec_driver_sql("CREATE UNIQUE INDEX ux_payslips_run_employee ON payslips(run_id, employee_id)")
+    _rollup_backfill(conn)
+
+_V8_JOBS = {
+    "sqlite": [
+        """
+        CREATE TABLE IF NOT EXISTS jobs(
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          kind TEXT NOT NULL, params TEXT,
+          status TEXT NOT NULL DEFAULT 'queued',
+          progress REAL NOT NULL DEFAULT 0, message TEXT,
+          result TEXT, error TEXT,
+          cancel_requested INTEGER NOT NULL DEFAULT 0,
+          created_at TEXT DEFAULT CURRENT_TIMESTAMP, started_at TEXT, finished_at TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_jobs_status ON jobs(status)",
+    ],
+    "postgresql": [
+        """
+        CREATE TABLE IF NOT EXISTS jobs(
+          id SERIAL PRIMARY KEY,
+          kind TEXT NOT NULL, params TEXT,
+          status TEXT NOT NULL DEFAULT 'queued',
+          progress DOUBLE PRECISION NOT NULL DEFAULT 0, message TEXT,
+          result TEXT, error TEXT,
+          cancel_requested INT NOT NULL DEFAULT 0,
+          created_at TIMESTAMP DEFAULT now(), started_at TIMESTAMP, finished_at TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_jobs_status ON jobs(status)",
+    ],
+}
+
+def _null_safe_attendance_key(conn):
+    # a NULL punch_in never conflicts in a plain unique index, so re-imports of
+    # punch_out-only rows piled up; collapse those duplicates and key on COALESCE
+    from .attendance import NO_PUNCH
+    conn.exec_driver_sql("""
+        DELETE FROM attendance_logs WHERE punch_in IS NULL AND id NOT IN (
+          SELECT MIN(id) FROM attendance_logs WHERE punch_in IS NULL GROUP BY employee_id, day
+        )
+    """)
+    conn.exec_driver_sql("DROP INDEX IF EXISTS ux_attendance_emp_day_in")
+    conn.exec_driver_sql(
+        "CREATE UNIQUE INDEX ux_attendance_emp_day_in ON attendance_logs"
+        f"(employee_id, day, (COALESCE(punch_in, {NO_PUNCH[conn.dialect.name]})))"
+    )
+    _rollup_backfill(conn)
+
+# per-table write counters behind lib.cache, shared by every process on the database
+_V10_TABLE_GENERATIONS = "CREATE TABLE IF NOT EXISTS table_generations(name TEXT PRIMARY KEY, gen BIGINT NOT NULL DEFAULT 0)"
+
+# which server process runs a job, and when it last said so (lib.jobs heartbeat)
+_V11_JOB_OWNERS = {
+    "sqlite": [
+        "ALTER TABLE jobs ADD COLUMN owner TEXT",
+        "ALTER TABLE jobs ADD COLUMN heartbeat_at TEXT",
+    ],
+    "postgresql": [
+        "ALTER TABLE jobs ADD COLUMN IF NOT EXISTS owner TEXT",
+        "ALTER TABLE jobs ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP",
+    ],
+}
+
+# the first DEFAULT_RULES seeded a 5% HRA on top of base salary; reset it where nobody changed it
+_V12_HRA_SEED = "UPDATE statutory_rules SET value = 0 WHERE component = 'hra' AND kind = 'rate' AND value = 0.05"
+
+Step = Union[str, Callable]
+MIGRATIONS: List[Tuple[int, str, Dict[str, List[Step]]]] = [
+    (1, "baseline tables + attendance unique key", {
+        "sqlite":     _statements(_baseline_sqlite()) + [_ensure_attendance_key],
+        "postgresql": _statements(_baseline_postgres()) + [_ensure_attendance_key],
+    }),
+    (2, "lookup indexes", {
+        "sqlite":     _V2_INDEXES,
+        "postgresql": _V2_INDEXES,
+    }),
+    (3, "typed attendance day/punch columns", {
+        "sqlite":     _V3_SQLITE_TYPED_ATTENDANCE,
+        "postgresql": [_V3_REJECTS],
+    }),
+    (4, "dashboard rollup tables", _V4_ROLLUPS),
+    (5, "statement name aliases", _V5_NAME_ALIASES),
+    (6, "payslip (run, employee) unique key", {
+        "sqlite":     [_ensure_payslip_key],
+        "postgresql": [_ensure_payslip_key],
+    }),
+    (7, "payslip input fingerprints", {
+        "sqlite":     ["ALTER TABLE payslips ADD COLUMN fingerprint TEXT"],
+        "postgresql": ["ALTER TABLE payslips ADD COLUMN IF NOT EXISTS fingerprint TEXT"],
+    }),
+    (8, "background jobs", _V8_JOBS),
+    (9, "NULL-safe attendance unique key", {
+        "sqlite":     [_null_safe_attendance_key],
+        "postgresql": [_null_safe_attendance_key],
+    }),
+    (10, "shared query-cache generations", {
+        "sqlite":     [_V10_TABLE_GENERATIONS],
+        "postgresql": [_V10_TABLE_GENERATIONS],
+    }),
+    (11, "job owners + heartbeats", _V11_JOB_OWNERS),
+    (12, "zero default HRA rate", {
+        "sqlite":     [_V12_HRA_SEED],
+        "postgresql": [_V12_HRA_SEED],
+    }),
+]
+
+LATEST = MIGRATIONS[-1][0]
+
+def _version_table(conn):
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS schema_migrations("
+        "version INTEGER PRIMARY KEY, name TEXT NOT NULL, "
+        "applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+    )
+
+def current_version(conn) -> int:
+    _version_table(conn)
+    return conn.exec_driver_sql("SELECT COALESCE(MAX(version), 0) FROM schema_migrations").scalar()
+
+def migrate(engine, target: Optional[int] = None) -> List[int]:
+    """
+    Apply every pending step up to `target` (default: latest), one transaction
+    per step. Returns the versions applied; a no-op once up to date.
+    """
+    target = LATEST if target is None else target
+    p = "?" if engine.dialect.name == "sqlite" else "%s"
+    with engine.begin() as conn:
+        done = current_version(conn)
+    applied = []
+    for version, name, steps in MIGRATIONS:
+        if version <= done or version > target:
+            continue
+        with engine.begin() as conn:
+            for step in steps[engine.dialect.name]:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.exec_driver_sql(step)
+            conn.exec_driver_sql(f"INSERT INTO schema_migrations(version, name) VALUES ({p}, {p})", (version, name))
+        applied.append(version)
+    return applied
@@ -1,40 +1,214 @@
+import datetime as dt
+import hashlib
+import json
+import os
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+import pandas as pd
 from sqlalchemy import text
-from .pdf import build_payslip_pdf
-from .storage import put_bytes, presigned_url
+from .cache import touch
+from .db import insert_returning_id, bulk_insert
+from .pdf import PAYSLIP_FIELDS_DETAILED, build_run_document, render_payslips, render_pool
+from .rollups import add_payslips
+from .statutory import COMPONENTS, RULE_COLUMNS, compute_statutory, load_rules
+from .storage import put_bytes, put_deduped
 
 def _param(engine):
     return "?" if engine.dialect.name == "sqlite" else "%s"
 
-def run_payroll(engine, month: int, year: int):
-    p = _param(engine)
+def _active_employees(engine):
+    active = "1" if engine.dialect.name == "sqlite" else "TRUE"
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql(
+            f"SELECT id, code, first_name, last_name, base_salary FROM employees WHERE active={active}"
+        ).fetchall()
+        rules = load_rules(conn)
+    df = pd.DataFrame([tuple(r) for r in rows], columns=["id", "code", "first_name", "last_name", "base_salary"])
+    return df, rules
+
+PAYSLIP_COLUMNS = ("run_id", "employee_id", "gross", "deductions", "net", "url", "fingerprint")
+# employees written per transaction by run_payroll; each commit is a resume point
+PAYROLL_CHECKPOINT = int(os.getenv("PAYROLL_CHECKPOINT", "500"))
+
+def upsert_payslips(conn, run_id: int, year: int, month: int, rows) -> Tuple[int, int]:
+    """
+    Bulk-upsert (employee_id, gross, deductions, net, url[, fingerprint]) rows into one run
+    and apply the net deltas to payroll_monthly. Returns (inserted, updated).
+    """
+    latest = {}
+    for r in rows:
+        emp, g, d, n, url, *fp = r
+        latest[int(emp)] = (float(g or 0), float(d or 0), float(n or 0), url, fp[0] if fp else None)
+    if not latest:
+        return 0, 0
+    p = "?" if conn.dialect.name == "sqlite" else "%s"
+    ne = "IS NOT" if conn.dialect.name == "sqlite" else "IS DISTINCT FROM"
+    # lock the run (row lock on Postgres, write lock on SQLite) before reading `before`,
+    # so a concurrent writer in another process can't apply the same rollup delta
+    conn.exec_driver_sql(f"UPDATE payroll_runs SET status = status WHERE id = {p}", (run_id,))
+    before = {
+        int(e): (float(g), float(d), float(n), url, fp)
+        for e, g, d, n, url, fp in conn.exec_driver_sql(
+            f"SELECT employee_id, gross, deductions, net, url, fingerprint FROM payslips WHERE run_id = {p}", (run_id,)
+        ).fetchall()
+    }
+    inserted = updated = 0
+    delta = [0.0, 0.0, 0.0]
+    for emp, (g, d, n, url, fp) in latest.items():
+        old = before.get(emp)
+        if old is None:
+            inserted += 1
+            old = (0.0, 0.0, 0.0, None, None)
+        elif old[:3] == (g, d, n) and url in (None, old[3]) and fp in (None, old[4]):
+            continue
+        else:
+            updated += 1
+        for i, v in enumerate((g, d, n)):
+            delta[i] += v - old[i]
+    bulk_insert(
+        conn, "payslips", PAYSLIP_COLUMNS,
+        [(run_id, emp, *vals) for emp, vals in latest.items()],
+        suffix=f"ON CONFLICT(run_id, employee_id) DO UPDATE SET gross=excluded.gross, "
+               f"deductions=excluded.deductions, net=excluded.net, url=COALESCE(excluded.url, payslips.url), "
+               f"fingerprint=CASE WHEN excluded.fingerprint IS NOT NULL THEN excluded.fingerprint "
+               f"WHEN payslips.gross {ne} excluded.gross OR payslips.deductions {ne} excluded.deductions "
+               f"OR payslips.net {ne} excluded.net THEN NULL ELSE payslips.fingerprint END "
+               f"WHERE payslips.gross {ne} excluded.gross OR payslips.deductions {ne} excluded.deductions "
+               f"OR payslips.net {ne} excluded.net "
+               f"OR (excluded.url IS NOT NULL AND payslips.url {ne} excluded.url) "
+               f"OR (excluded.fingerprint IS NOT NULL AND payslips.fingerprint {ne} excluded.fingerprint)",
+    )
+    add_payslips(conn, year, month, inserted, *delta)
+    return inserted, updated
+
+def _fingerprints(calc: pd.DataFrame, rules: pd.DataFrame, merged: bool) -> List[str]:
+    """
+    Per-employee hash of everything that shapes a payslip: identity, salary
+    inputs, the statutory rule set, the template and the storage layout.
+    """
+    shared = hashlib.sha256(
+        rules.sort_values(RULE_COLUMNS).to_csv(index=False).encode()
+        + repr((PAYSLIP_FIELDS_DETAILED, merged)).encode()
+    ).hexdigest()
+    return [
+        hashlib.sha256(json.dumps([shared, r.code, r.first_name, r.last_name, float(r.base_salary)]).encode()).hexdigest()
+        for r in calc.itertuples(index=False)
+    ]
+
+_period_locks: Dict[Tuple[int, int], threading.Lock] = {}
+_period_locks_guard = threading.Lock()
+
+def _period_lock(month: int, year: int) -> threading.Lock:
+    with _period_locks_guard:
+        return _period_locks.setdefault((int(month), int(year)), threading.Lock())
+
+def _set_status(engine, run_id: int, status: str) -> None:
+    p = "?" if engine.dialect.name == "sqlite" else "%s"
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"UPDATE payroll_runs SET status = {p}, processed_on = {p} WHERE id = {p}",
+                             (status, dt.datetime.utcnow(), run_id))
+        touch(conn, "payroll_runs")
+
+def _open_run(engine, month: int, year: int):
+    """
+    Latest run_payroll-created run for the period (status Running,
+    Interrupted or Completed), or a new one; marked Running until run_payroll finishes.
+    Returns (run_id, {employee_id: (fingerprint, url)}) for slips already written.
+    """
+    p = "?" if engine.dialect.name == "sqlite" else "%s"
     with engine.begin() as conn:
-        # create run
-        conn.exec_driver_sql(f"INSERT INTO payroll_runs(month,year,status) VALUES ({p},{p},{p})",
-                             (month, year, "Processing"))
-        run_id = conn.exec_driver_sql("SELECT max(id) FROM payroll_runs").scalar()
-
-        # process each employee
-        rows = conn.exec_driver_sql("SELECT id, code, first_name, last_name, base_salary FROM employees WHERE active=TRUE" if engine.dialect.name!="sqlite"
-                                    else "SELECT id, code, first_name, last_name, base_salary FROM employees WHERE active=1").fetchall()
-        results = []
-        for r in rows:
-            basic = float(r.base_salary)
-            pf = round(basic * 0.12, 2)  # demo PF
-            tds = 0.0                    # demo TDS
-            gross = basic
-            deductions = pf + tds
-            net = gross - deductions
-
-            pdf = build_payslip_pdf(f"{r.first_name} {r.last_name}", r.code, month, year, gross, deductions, net)
-            key = f"{year}/{month:02d}/payslip_{r.code}.pdf"
-            stored = put_bytes(key, pdf)
-            url = presigned_url(key) or stored
-
-            conn.exec_driver_sql(
-                f"INSERT INTO payslips(run_id, employee_id, gross, deductions, net, url) VALUES ({p},{p},{p},{p},{p},{p})",
-                (run_id, r.id, gross, deductions, net, url)
-            )
-            results.append({"code": r.code, "name": f"{r.first_name} {r.last_name}", "gross": gross, "deductions": deductions, "net": net, "url": url})
-
-        conn.exec_driver_sql("UPDATE payroll_runs SET status='Completed' WHERE id=" + str(run_id))
-        return results
+        row = conn.exec_driver_sql(
+            f"SELECT id FROM payroll_runs WHERE month = {p} AND year = {p} AND status IN ('Running', 'Interrupted', 'Completed') "
+            "ORDER BY id DESC LIMIT 1", (month, year),
+        ).first()
+        if row:
+            run_id = int(row[0])
+            conn.exec_driver_sql(f"UPDATE payroll_runs SET status = 'Running' WHERE id = {p}", (run_id,))
+        else:
+            run_id = insert_returning_id(conn, "payroll_runs", ("month", "year", "status"), (month, year, "Running"))
+        touch(conn, "payroll_runs")
+        done = {
+            int(e): (fp, url)
+            for e, fp, url in conn.exec_driver_sql(
+                f"SELECT employee_id, fingerprint, url FROM payslips WHERE run_id = {p}", (run_id,)
+            ).fetchall()
+        }
+    return run_id, done
+
+def _upload_separate(engine, slips, month: int, year: int, workers: Optional[int], pool=None):
+    # renders stream straight into the deduping, concurrent uploader as they complete
+    keys = [f"{year}/{month:02d}/payslip_{slip['code']}.pdf" for slip in slips]
+    return put_deduped(engine, zip(keys, render_payslips(slips, workers=workers, pool=pool)))
+
+def _upload_merged(engine, slips, month: int, year: int):
+    doc, index = build_run_document(slips)
+    [blob], [hit] = put_deduped(engine, [(f"{year}/{month:02d}/payroll_run.pdf", doc)])
+    put_bytes(f"{year}/{month:02d}/payroll_run.index.json", json.dumps(index).encode(), content_type="application/json")
+    return [f"{blob}#page={index[s['employee_id']][0]}" for s in slips], [hit] * len(slips)
+
+def run_payroll(engine, month: int, year: int, workers: Optional[int] = None, merged: bool = False,
+                checkpoint: int = PAYROLL_CHECKPOINT, progress: Optional[Callable[[int, int], None]] = None):
+    """
+    Compute, render and store payslips for every active employee whose input fingerprint changed,
+    committing every `checkpoint` slips (merged=True: one paged run document).
+    Returns one dict per employee with "rendered" and "reused" flags.
+    """
+    # one run per period at a time in this process; a queued duplicate then finds everything current
+    with _period_lock(month, year):
+        return _run_payroll(engine, month, year, workers, merged, checkpoint, progress)
+
+def _run_payroll(engine, month: int, year: int, workers: Optional[int], merged: bool,
+                 checkpoint: int, progress: Optional[Callable[[int, int], None]]):
+    employees, rules = _active_employees(engine)
+    calc = compute_statutory(employees, rules)
+    fps = _fingerprints(calc, rules, merged)
+    slips = [
+        {"employee_id": int(r.id), "code": r.code, "name": f"{r.first_name} {r.last_name}",
+         "month": month, "year": year, **{k: float(getattr(r, k)) for k in COMPONENTS}}
+        for r in calc.itertuples(index=False)
+    ]
+    run_id, done = _open_run(engine, month, year)
+
+    todo = [i for i, (slip, fp) in enumerate(zip(slips, fps))
+            if done.get(slip["employee_id"], (None, None))[0] != fp]
+    if merged and todo:
+        todo = list(range(len(slips)))
+    keys = {s["employee_id"]: done[s["employee_id"]][1] for s in slips if s["employee_id"] in done}
+    reused = dict.fromkeys(keys, True)
+
+    step = max(1, len(todo) if merged else checkpoint)
+    # one render pool for the whole run, not one per checkpoint batch
+    pool = render_pool(len(todo), workers) if todo and not merged else None
+    try:
+        for start in range(0, len(todo), step):
+            part = todo[start:start + step]
+            batch = [slips[i] for i in part]
+            if merged:
+                bkeys, bhits = _upload_merged(engine, batch, month, year)
+            else:
+                bkeys, bhits = _upload_separate(engine, batch, month, year, workers, pool)
+            with engine.begin() as conn:
+                upsert_payslips(conn, run_id, year, month, [
+                    (s["employee_id"], s["gross"], s["deductions"], s["net"], key, fps[i])
+                    for i, s, key in zip(part, batch, bkeys)
+                ])
+                touch(conn, "payroll_runs", "payslips", "payroll_monthly")
+            for s, key, hit in zip(batch, bkeys, bhits):
+                keys[s["employee_id"]], reused[s["employee_id"]] = key, hit
+            if progress:
+                progress(start + len(part), len(todo))
+    except BaseException:
+        # committed batches stay; the next run for this period resumes after them
+        _set_status(engine, run_id, "Interrupted")
+        raise
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    _set_status(engine, run_id, "Completed")
+
+    rendered = {slips[i]["employee_id"] for i in todo}
+    return [{"code": s["code"], "name": s["name"], **{k: s[k] for k in COMPONENTS},
+             "key": keys[s["employee_id"]], "reused": reused[s["employee_id"]],
+             "rendered": s["employee_id"] in rendered}
+            for s in slips]
@@ -0,0 +1,143 @@
+# lib/payslip_batch.py
+"""
+Batch ingestion of contractor payslip PDFs (many files or a zip).
+
+Files are parsed on a process pool, employees and payroll runs are resolved
+once for the whole batch, originals are uploaded concurrently (deduped), and
+payslips are bulk-upserted per run on (run_id, employee_id), so re-ingesting
+the same files is harmless. Every file gets a report row.
+"""
+from __future__ import annotations
+import datetime as dt
+import os
+import time
+import zipfile
+from io import BytesIO
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import pandas as pd
+
+from .cache import touch
+from .db import bulk_insert_returning
+from .pdf_ingest import parse_payslips
+from .payroll import upsert_payslips
+from .storage import put_deduped
+
+REPORT_COLUMNS = ["file", "status", "name", "month", "year", "employee_id", "net", "reused", "error"]
+
+def expand_uploads(files: Iterable[Tuple[str, bytes]]) -> List[Tuple[str, bytes]]:
+    """Flatten (filename, bytes) uploads: .zip archives contribute their .pdf members."""
+    out = []
+    for name, data in files:
+        if name.lower().endswith(".zip"):
+            with zipfile.ZipFile(BytesIO(data)) as zf:
+                for info in zf.infolist():
+                    base = os.path.basename(info.filename)
+                    if info.is_dir() or not base.lower().endswith(".pdf") or base.startswith(".") \
+                            or info.filename.startswith("__MACOSX/"):
+                        continue
+                    out.append((f"{name}/{info.filename}", zf.read(info)))
+        else:
+            out.append((name, data))
+    return out
+
+def _split(name: str) -> Tuple[str, str]:
+    fname, *rest = name.strip().split(" ")
+    return fname, " ".join(rest) if rest else ""
+
+def _new_code(name: str, taken: set) -> str:
+    # same scheme as the single-slip save, stepped past codes already in use
+    n = abs(hash(name)) % 10_000
+    while f"E{n}" in taken:
+        n += 1
+    taken.add(f"E{n}")
+    return f"E{n}"
+
+def _resolve_employees(conn, names: List[str]) -> Tuple[Dict[Tuple[str, str], int], int]:
+    """(lower first, lower last) -> employee id for every name; unknown names are created in one batch."""
+    ids, taken = {}, set()
+    for i, first, last, code in conn.exec_driver_sql(
+            "SELECT id, first_name, last_name, code FROM employees ORDER BY id").fetchall():
+        ids.setdefault(((first or "").lower(), (last or "").lower()), int(i))
+        taken.add(code)
+    missing = {}
+    for name in names:
+        first, last = _split(name)
+        k = (first.lower(), last.lower())
+        if k not in ids and k not in missing:
+            missing[k] = (first, last, name)
+    if missing:
+        rows = [(_new_code(name, taken), first, last, 0, 1) for first, last, name in missing.values()]
+        made = bulk_insert_returning(conn, "employees", ("code", "first_name", "last_name", "base_salary", "active"),
+                                     rows, returning="id")
+        for k, (i,) in zip(missing, made):
+            ids[k] = int(i)
+    return ids, len(missing)
+
+def resolve_runs(conn, periods) -> Dict[Tuple[int, int], int]:
+    """(month, year) -> payroll run id; missing runs are created as 'Imported'."""
+    runs = {}
+    for i, month, year in conn.exec_driver_sql("SELECT id, month, year FROM payroll_runs ORDER BY id").fetchall():
+        runs.setdefault((int(month), int(year)), int(i))
+    missing = sorted(set(periods) - runs.keys())
+    if missing:
+        now = dt.datetime.utcnow()
+        made = bulk_insert_returning(conn, "payroll_runs", ("month", "year", "status", "processed_on"),
+                                     [(m, y, "Imported", now) for m, y in missing], returning="id, month, year")
+        runs.update({(int(m), int(y)): int(i) for i, m, y in made})
+    return runs
+
+def ingest_payslips(engine, files: Iterable[Tuple[str, bytes]], workers: Optional[int] = None,
+                    progress: Optional[Callable[[int, int], None]] = None) -> Tuple[pd.DataFrame, Dict]:
+    """
+    Ingest many payslip PDFs (zips are expanded). Returns (report, stats):
+    one report row per file (status 'saved' or 'error') and stats with
+    files, saved, failed, created (employees), inserted/updated payslips,
+    seconds and files_per_sec.
+    """
+    t0 = time.perf_counter()
+    files = expand_uploads(files)
+    parsed = parse_payslips([data for _, data in files], workers=workers, progress=progress)
+
+    report, ok = [], []
+    for (fname, data), (p, err) in zip(files, parsed):
+        row = dict.fromkeys(REPORT_COLUMNS)
+        row.update(file=fname, status="error", error=err)
+        if p is not None:
+            row.update(name=p.get("name"), month=p.get("month"), year=p.get("year"), net=p.get("net"))
+            if not (p.get("name") or "").strip() or not p.get("month") or not p.get("year"):
+                row["error"] = "could not read employee name / month / year"
+            else:
+                ok.append((len(report), data, p))
+        report.append(row)
+
+    created = inserted = updated = 0
+    if ok:
+        with engine.begin() as conn:
+            emp_ids, created = _resolve_employees(conn, [p["name"] for _, _, p in ok])
+            run_ids = resolve_runs(conn, [(int(p["month"]), int(p["year"])) for _, _, p in ok])
+        # upload outside any transaction; dedupe skips bytes already stored
+        slips = []
+        for n, data, p in ok:
+            first, last = _split(p["name"])
+            emp_id = emp_ids[(first.lower(), last.lower())]
+            month, year = int(p["month"]), int(p["year"])
+            slips.append((n, emp_id, month, year, p, f"uploads/{year}/{month:02d}/payslip_{emp_id}.pdf", data))
+        keys, reused = put_deduped(engine, ((key, data) for *_, key, data in slips))
+
+        per_run: Dict[Tuple[int, int], List] = {}
+        for (n, emp_id, month, year, p, _, _), key, hit in zip(slips, keys, reused):
+            gross, net = p.get("gross") or 0, p.get("net") or 0
+            per_run.setdefault((year, month), []).append((emp_id, gross, gross - net, net, key))
+            report[n].update(status="saved", employee_id=emp_id, reused=hit, error=None)
+        with engine.begin() as conn:
+            for (year, month), rows in per_run.items():
+                ins, upd = upsert_payslips(conn, run_ids[(month, year)], year, month, rows)
+                inserted += ins; updated += upd
+            touch(conn, "employees", "payroll_runs", "payslips", "payroll_monthly")
+
+    seconds = time.perf_counter() - t0
+    saved = sum(r["status"] == "saved" for r in report)
+    stats = {"files": len(report), "saved": saved, "failed": len(report) - saved, "created": created,
+             "inserted": inserted, "updated": updated,
+             "seconds": round(seconds, 2), "files_per_sec": round(len(report) / seconds, 1) if seconds else 0.0}
+    return pd.DataFrame(report, columns=REPORT_COLUMNS), stats
@@ -1,22 +1,233 @@
+import os
+import zlib
 from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
 from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
+from reportlab.pdfbase.pdfmetrics import stringWidth
 
-def build_payslip_pdf(emp_name, code, month, year, gross, deductions, net):
+# Render processes for batch payslip rendering; 0/unset -> one per CPU, 1 -> serial.
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "0") or 0)
+
+# (label, key) pairs drawn top to bottom; keys index the slip dict.
+PAYSLIP_FIELDS: Tuple[Tuple[str, str], ...] = (
+    ("Employee", "name"),
+    ("Code", "code"),
+    ("Gross", "gross"),
+    ("Deductions", "deductions"),
+    ("Net Pay", "net"),
+)
+
+PAYSLIP_FIELDS_DETAILED: Tuple[Tuple[str, str], ...] = (
+    ("Employee", "name"),
+    ("Code", "code"),
+    ("Basic", "basic"),
+    ("HRA", "hra"),
+    ("Gross", "gross"),
+    ("PF (Employee)", "pf_ee"),
+    ("ESI (Employee)", "esi_ee"),
+    ("LWF (Employee)", "lwf_ee"),
+    ("TDS", "tds"),
+    ("Deductions", "deductions"),
+    ("Net Pay", "net"),
+)
+
+_LABEL_X, _VALUE_X, _TOP, _STEP = 50, 300, 770, 20
+_FONTS = b"<< /F1 3 0 R /F2 4 0 R >>"
+
+def _pdf_str(s) -> bytes:
+    b = str(s).encode("cp1252", errors="replace")
+    return b"(" + b.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+def _fmt(v) -> str:
+    return f"{v:,.2f}" if isinstance(v, (int, float)) else str(v or "")
+
+class PayslipTemplate:
+    """
+    Payslip renderer that writes the static layout (title, labels, rule) once
+    as a form XObject and, per slip, only emits a tiny content stream that
+    places the template and stamps the values. The document objects around
+    that stream are serialized once and reused byte-for-byte.
+    """
+
+    def __init__(self, fields=PAYSLIP_FIELDS):
+        self.fields = tuple(fields)
+        self.page_size = A4
+        self._title_x = _LABEL_X + stringWidth("Payslip", "Helvetica-Bold", 16)
+
+        ops = [b"BT /F2 16 Tf 1 0 0 1 %d 800 Tm (Payslip) Tj /F1 12 Tf" % _LABEL_X]
+        y = _TOP
+        for label, _ in self.fields:
+            ops.append(b"1 0 0 1 %d %d Tm %s Tj" % (_LABEL_X, y, _pdf_str(label + ":")))
+            y -= _STEP
+        ops.append(b"ET")
+        ops.append(b"0.5 w %d %d m %d %d l S" % (_LABEL_X, y + _STEP - 6, _VALUE_X, y + _STEP - 6))
+        self._static = b"\n".join(ops)
+
+        # header + objects 1..6 of a single-page slip; object 7 is the per-slip stream
+        self._head, self._offsets = _serialize(self.document_objects(b"6 0 R", 1) + [self.page_object(7)])
+
+    def document_objects(self, page_refs: bytes, count: int):
+        """Catalog, page tree, fonts and the static form XObject (objects 1..5); pages follow from 6."""
+        w, h = self.page_size
+        return [
+            b"<< /Type /Catalog /Pages 2 0 R >>",
+            b"<< /Type /Pages /Kids [%s] /Count %d >>" % (page_refs, count),
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>",
+            _stream(self._static, b"/Type /XObject /Subtype /Form /BBox [0 0 %.4f %.4f] /Resources << /Font %s >> "
+                    % (w, h, _FONTS)),
+        ]
+
+    def page_object(self, contents_ref: int) -> bytes:
+        w, h = self.page_size
+        return (b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.4f %.4f] "
+                b"/Resources << /Font %s /XObject << /Tpl 5 0 R >> >> /Contents %d 0 R >>"
+                % (w, h, _FONTS, contents_ref))
+
+    def values_stream(self, slip: Dict) -> bytes:
+        """Content stream that places the template and stamps one slip's values."""
+        period = f" {int(slip['month']):02d}/{slip['year']}"
+        ops = [b"q /Tpl Do Q",
+               b"BT /F2 16 Tf 1 0 0 1 %.2f 800 Tm %s Tj /F1 12 Tf" % (self._title_x, _pdf_str(period))]
+        y = _TOP
+        for _, key in self.fields:
+            v = slip.get(key)
+            txt = _fmt(v)
+            # right-align amounts on the value column, text starts just left of it
+            x = _VALUE_X - stringWidth(txt, "Helvetica", 12) if isinstance(v, (int, float)) else _LABEL_X + 110
+            ops.append(b"1 0 0 1 %.2f %d Tm %s Tj" % (x, y, _pdf_str(txt)))
+            y -= _STEP
+        ops.append(b"ET")
+        return b"\n".join(ops)
+
+    def render(self, slip: Dict) -> bytes:
+        """Render one slip dict (month, year and the field keys) to PDF bytes."""
+        return _finish(self._head, self._offsets, [_stream(self.values_stream(slip))])
+
+@lru_cache(maxsize=8)
+def payslip_template(fields=PAYSLIP_FIELDS) -> PayslipTemplate:
+    return PayslipTemplate(fields)
+
+def _stream(data: bytes, dict_entries: bytes = b"") -> bytes:
+    data = zlib.compress(data)
+    return b"<< %s/Filter /FlateDecode /Length %d >>\nstream\n%s\nendstream" % (dict_entries, len(data), data)
+
+def _serialize(objs, start: int = 1, head: bytes = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"):
+    out, offsets = bytearray(head), []
+    for i, body in enumerate(objs, start):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (i, body)
+    return bytes(out), offsets
+
+def _xref(offsets, xref_pos: int) -> bytes:
+    return (b"xref\n0 %d\n0000000000 65535 f \n" % (len(offsets) + 1)
+            + b"".join(b"%010d 00000 n \n" % o for o in offsets)
+            + b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(offsets) + 1, xref_pos))
+
+def _finish(head: bytes, offsets, tail_objs) -> bytes:
+    out, offsets = bytearray(head), list(offsets)
+    for body in tail_objs:
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (len(offsets), body)
+    return bytes(out + _xref(offsets, len(out)))
+
+def write_run_document(fp: BinaryIO, slips: Iterable[Dict], fields=PAYSLIP_FIELDS_DETAILED,
+                       key: str = "employee_id") -> Dict[int, List[int]]:
+    """
+    Stream every slip of a run into one multi-page PDF on `fp` in a single pass.
+    All pages share one static template XObject and font set.
+    Returns the page index {slip[key]: [page_no, offset, length]}, where offset/length
+    locate the page's content stream object in the file so extract_payslip
+    can cut a single slip back out without re-rendering.
+    """
+    tpl = payslip_template(tuple(fields))
+    head = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"
+    fp.write(head)
+    pos, offsets, index = len(head), {}, {}
+
+    def put(num: int, body: bytes) -> int:
+        nonlocal pos
+        obj = b"%d 0 obj\n%s\nendobj\n" % (num, body)
+        offsets[num] = pos
+        fp.write(obj)
+        pos += len(obj)
+        return offsets[num] + len(b"%d 0 obj\n" % num)
+
+    fixed = tpl.document_objects(b"", 0)
+    for num, body in zip((3, 4, 5), fixed[2:]):
+        put(num, body)
+
+    kids = []
+    for i, slip in enumerate(slips):
+        contents, page = 6 + 2 * i, 7 + 2 * i
+        body = _stream(tpl.values_stream(slip))
+        index[slip[key]] = [i + 1, put(contents, body), len(body)]
+        put(page, tpl.page_object(contents))
+        kids.append(b"%d 0 R" % page)
+
+    catalog, pages = tpl.document_objects(b" ".join(kids), len(kids))[:2]
+    put(1, catalog)
+    put(2, pages)
+    fp.write(_xref([offsets[n] for n in range(1, len(offsets) + 1)], pos))
+    return index
+
+def build_run_document(slips: Iterable[Dict], fields=PAYSLIP_FIELDS_DETAILED,
+                       key: str = "employee_id") -> Tuple[bytes, Dict[int, List[int]]]:
     buf = BytesIO()
-    c = canvas.Canvas(buf, pagesize=A4)
-    c.setFont("Helvetica-Bold", 16)
-    c.drawString(50, 800, f"Payslip  {month:02d}/{year}")
-    c.setFont("Helvetica", 12)
-    y = 770
-    for k, v in [
-        ("Employee", emp_name),
-        ("Code", code),
-        ("Gross", f"{gross:,.2f}"),
-        ("Deductions", f"{deductions:,.2f}"),
-        ("Net Pay", f"{net:,.2f}"),
-    ]:
-        c.drawString(50, y, f"{k}: {v}")
-        y -= 20
-    c.showPage(); c.save()
-    return buf.getvalue()
+    index = write_run_document(buf, slips, fields, key)
+    return buf.getvalue(), index
+
+def extract_payslip(doc: bytes, entry: List[int], fields=PAYSLIP_FIELDS_DETAILED) -> bytes:
+    """
+    Cut one slip out of a run document as a standalone PDF, given its page
+    index entry [page_no, offset, length]. Works on a ranged read of just
+    those bytes too (pass doc=that slice and entry=[page_no, 0, length]).
+    """
+    _, offset, length = entry
+    tpl = payslip_template(tuple(fields))
+    return _finish(tpl._head, tpl._offsets, [doc[offset:offset + length]])
+
+def build_payslip_pdf(emp_name, code, month, year, gross, deductions, net):
+    return payslip_template().render({
+        "name": emp_name, "code": code, "month": month, "year": year,
+        "gross": gross, "deductions": deductions, "net": net,
+    })
+
+def _render_job(job) -> bytes:
+    fields, slip = job
+    return payslip_template(fields).render(slip)
+
+def render_pool(n_slips: int, workers: Optional[int] = None) -> Optional[ProcessPoolExecutor]:
+    """
+    Process pool sized like render_payslips' own, for callers that render in
+    several batches (run_payroll checkpoints); None when rendering would be serial.
+    The caller shuts it down.
+    """
+    workers = workers if workers is not None else (PDF_WORKERS or os.cpu_count() or 1)
+    workers = min(workers, n_slips)
+    return ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+
+def render_payslips(slips: Iterable[Dict], fields=PAYSLIP_FIELDS_DETAILED,
+                    workers: Optional[int] = None, chunksize: int = 64,
+                    pool: Optional[ProcessPoolExecutor] = None) -> Iterator[bytes]:
+    """
+    Render many slip dicts with the cached template for `fields`.
+    Fans out over a process pool and yields PDF bytes in input order as they
+    become ready, so callers can upload/insert while later slips still render.
+    workers <= 1 renders serially in-process (tests, tiny runs). Pass `pool`
+    (see render_pool) to reuse one across calls instead of starting a new one.
+    """
+    jobs = [(tuple(fields), s) for s in slips]
+    if pool is not None:
+        yield from pool.map(_render_job, jobs, chunksize=chunksize)
+        return
+    workers = workers if workers is not None else (PDF_WORKERS or os.cpu_count() or 1)
+    workers = min(workers, len(jobs))
+    if workers <= 1:
+        for job in jobs:
+            yield _render_job(job)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(_render_job, jobs, chunksize=chunksize)
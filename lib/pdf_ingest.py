@@ -1,8 +1,23 @@
+import hashlib
+import os
+import pickle
 import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import pdfplumber
 import pandas as pd
 from io import BytesIO
-from typing import Dict, Any, List
+from typing import Dict, Any, Callable, Iterable, Iterator, List, Optional, Tuple
+
+# Bump a parser's version whenever its extraction regexes/rules change; its old
+# cache entries then miss while the other parser's stay valid.
+PARSER_VERSIONS = {"payslip": "3", "consolidated": "3"}
+# Parsed results kept in memory per process; PARSE_CACHE_DIR adds a disk layer.
+PARSE_CACHE_SIZE = int(os.getenv("PARSE_CACHE_SIZE", "64"))
+PARSE_CACHE_DIR = os.getenv("PARSE_CACHE_DIR")
+# Parse processes for batch ingestion; 0/unset -> one per CPU, 1 -> serial.
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "0") or 0)
 
 MONTH_MAP = {
     "JAN":1,"FEB":2,"MAR":3,"APR":4,"MAY":5,"JUN":6,
@@ -17,72 +32,254 @@ def _extract_text(file_bytes: bytes) -> str:
             parts.append(txt)
         return "\n".join(parts)
 
+def _page_texts(file_bytes: bytes):
+    # lazily, one page at a time: callers stop reading once they have what they need
+    with pdfplumber.open(BytesIO(file_bytes)) as pdf:
+        for p in pdf.pages:
+            yield p.extract_text() or ""
+            p.close()  # drop the page's parsed layout objects
+
+# payslip fields, compiled once; each is searched like re.search(pat, text, re.I)
+_PERIOD = re.compile(r"PAY SLIP FOR THE MONTH OF\s+([A-Z]{3})\s+(\d{4})", re.I)
+_NAME = re.compile(r"NAME OF THE STAFF:\s*([A-Z][A-Z\s\.\-']+)", re.I)
+_AMOUNTS = {
+    "basic":    re.compile(r"BASIC\s*PAY.*?:\s*([0-9\.,]+)", re.I),
+    "hra":      re.compile(r"H\.?R\.?A.*?:\s*([0-9\.,]+)", re.I),
+    "gross":    re.compile(r"(?:SUB TOTAL|GROSS SALARY|SUB\s*TOTAL.*\[B\])\D+([0-9\.,]+)", re.I),
+    "pf_ee":    re.compile(r"PROVIDENT FUND\s*\(EMPLOYEE\).*?:\s*([0-9\.,]+)", re.I),
+    "pf_er":    re.compile(r"PROVIDENT FUND\s*\(EMPLOYER\).*?:\s*([0-9\.,]+)", re.I),
+    "esi_ee":   re.compile(r"E\.?S\.?I\.?C\.?\s*\(EMPLOYEE\).*?:\s*([0-9\.,]+)", re.I),
+    "esi_er":   re.compile(r"E\.?S\.?I\.?C\.?\s*\(EMPLOYER\).*?:\s*([0-9\.,]+)", re.I),
+    "lwf_ee":   re.compile(r"L\.?W\.?F\.?\s*\(EMPLOYEE\).*?:\s*([0-9\.,]+)", re.I),
+    "lwf_er":   re.compile(r"L\.?W\.?F\.?\s*\(EMPLOYER\).*?:\s*([0-9\.,]+)", re.I),
+    "admin_pf": re.compile(r"ADMIN.*?CHARGES.*?:\s*([0-9\.,]+)", re.I),
+    "net":      re.compile(r"NET\s*(?:PAYABLE|PAY).+?:\s*Rs?\.?\s*([0-9\.,]+)", re.I),
+}
+# characters of the previous page searched again with the next one
+_OVERLAP = 256
+
+def _amount(m):
+    if not m: return None
+    s = m.group(1).replace(",", "")
+    try: return float(s)
+    except ValueError: return None
+
 def parse_payslip(file_bytes: bytes) -> Dict[str, Any]:
     """
     Parse single pay slip PDF.
     Returns dict: name, month, year, gross, basic, hra, pf_ee, pf_er, esi_ee, esi_er, lwf_ee, lwf_er, admin_pf, net
-    """
-    text = _extract_text(file_bytes)
 
-    def num(pat):
-        m = re.search(pat, text, re.I)
-        if not m: return None
-        s = m.group(1).replace(",", "")
-        try: return float(s)
-        except: return None
+    Pages are extracted one at a time and the precompiled field patterns run
+    only on the new page plus the tail of the previous one (_OVERLAP chars, for
+    a label and its value split across the break). Extraction stops after the
+    page where NET PAYABLE matches, since that line closes the
+    earnings/deductions block; fields still missing by then are None, and
+    annex pages after the block are never read. raw_text holds the pages read.
+    """
+    pages, found = [], {}
+    for page in _page_texts(file_bytes):
+        window = (pages[-1][-_OVERLAP:] + "\n" + page) if pages else page
+        pages.append(page)
+        if "period" not in found and (m := _PERIOD.search(window)):
+            found["period"] = m
+        if "name" not in found and (m := _NAME.search(window)):
+            found["name"] = m
+        for field, pat in _AMOUNTS.items():
+            if field not in found and (m := pat.search(window)):
+                found[field] = m
+        if "net" in found:
+            break
+    text = "\n".join(pages)
 
-    # month/year
-    m = re.search(r"PAY SLIP FOR THE MONTH OF\s+([A-Z]{3})\s+(\d{4})", text, re.I)
+    m = found.get("period")
     month = MONTH_MAP.get(m.group(1).upper(), None) if m else None
     year = int(m.group(2)) if m else None
-
-    # name
-    mname = re.search(r"NAME OF THE STAFF:\s*([A-Z][A-Z\s\.\-']+)", text, re.I)
-    name = mname.group(1).strip() if mname else None
-
-    # parts
-    basic  = num(r"BASIC\s*PAY.*?:\s*([0-9\.,]+)")
-    hra    = num(r"H\.?R\.?A.*?:\s*([0-9\.,]+)")
-    gross  = num(r"(?:SUB TOTAL|GROSS SALARY|SUB\s*TOTAL.*\[B\])\D+([0-9\.,]+)")
-    pf_ee  = num(r"PROVIDENT FUND\s*\(EMPLOYEE\).*?:\s*([0-9\.,]+)")
-    pf_er  = num(r"PROVIDENT FUND\s*\(EMPLOYER\).*?:\s*([0-9\.,]+)")
-    esi_ee = num(r"E\.?S\.?I\.?C\.?\s*\(EMPLOYEE\).*?:\s*([0-9\.,]+)")
-    esi_er = num(r"E\.?S\.?I\.?C\.?\s*\(EMPLOYER\).*?:\s*([0-9\.,]+)")
-    lwf_ee = num(r"L\.?W\.?F\.?\s*\(EMPLOYEE\).*?:\s*([0-9\.,]+)")
-    lwf_er = num(r"L\.?W\.?F\.?\s*\(EMPLOYER\).*?:\s*([0-9\.,]+)")
-    admin  = num(r"ADMIN.*?CHARGES.*?:\s*([0-9\.,]+)")
-    net    = num(r"NET\s*(?:PAYABLE|PAY).+?:\s*Rs?\.?\s*([0-9\.,]+)")
+    name = found["name"].group(1).strip() if "name" in found else None
+    amounts = {field: _amount(found.get(field)) for field in _AMOUNTS}
 
     return {
         "name": name, "month": month, "year": year,
-        "gross": gross, "basic": basic, "hra": hra,
-        "pf_ee": pf_ee, "pf_er": pf_er, "esi_ee": esi_ee, "esi_er": esi_er,
-        "lwf_ee": lwf_ee, "lwf_er": lwf_er, "admin_pf": admin, "net": net,
+        "gross": amounts["gross"], "basic": amounts["basic"], "hra": amounts["hra"],
+        "pf_ee": amounts["pf_ee"], "pf_er": amounts["pf_er"], "esi_ee": amounts["esi_ee"], "esi_er": amounts["esi_er"],
+        "lwf_ee": amounts["lwf_ee"], "lwf_er": amounts["lwf_er"], "admin_pf": amounts["admin_pf"], "net": amounts["net"],
         "raw_text": text,
     }
 
-def parse_consolidated(file_bytes: bytes) -> pd.DataFrame:
+CONSOLIDATED_COLUMNS = ["name", "designation", "wage_rate", "net"]
+_NUMERIC_CELL = r"[0-9,\.]+"
+
+def _consolidated_rows(lines: List[str]) -> pd.DataFrame:
+    """
+    Vectorized row parsing for one page of table lines (| SR | NAME | ... |).
+    Rows need >= 10 cells and a numeric SR NO; net is the last numeric cell
+    among the final four. Rows with an unparseable wage rate or net are skipped.
+    """
+    s = pd.Series(lines, dtype="object")
+    s = s[s.str.strip().str.startswith("|")]
+    if s.empty:
+        return pd.DataFrame(columns=CONSOLIDATED_COLUMNS)
+    cells = s.str.split("|", expand=True).apply(lambda c: c.str.strip())
+    width = s.str.count(r"\|") + 1
+    keep = (width >= 10) & cells[1].fillna("").str.isdigit()
+    cells, width = cells[keep], width[keep]
+    if cells.empty:
+        return pd.DataFrame(columns=CONSOLIDATED_COLUMNS)
+
+    wage_txt = cells[6].fillna("")
+    wage = pd.to_numeric(wage_txt.str.replace(",", "", regex=False), errors="coerce")
+    bad = wage.isna() & wage_txt.ne("")
+
+    # the last four cells sit at different columns per row width; walk them left to right
+    net = pd.Series(float("nan"), index=cells.index)
+    for w in width.unique():
+        rows = width == w
+        for col in range(w - 4, w):
+            txt = cells.loc[rows, col]
+            is_num = txt.str.fullmatch(_NUMERIC_CELL).fillna(False).astype(bool)
+            val = pd.to_numeric(txt.where(is_num).str.replace(",", "", regex=False), errors="coerce")
+            bad.loc[rows] |= is_num & val.isna()
+            net.loc[rows] = val.where(is_num, net.loc[rows])
+
+    out = pd.DataFrame({"name": cells[2], "designation": cells[5], "wage_rate": wage, "net": net})
+    return out[~bad].reset_index(drop=True)
+
+def iter_consolidated(file_bytes: bytes,
+                      progress: Optional[Callable[[int, int, int], None]] = None) -> Iterator[pd.DataFrame]:
+    """
+    Yield the consolidated table one page at a time as DataFrames
+    (name, designation, wage_rate, net), so memory stays bounded by a page and
+    callers can show the first rows while later pages are still extracted.
+    `progress(pages_done, pages_total, rows_so_far)` is called after each page.
+    """
+    rows = 0
+    with pdfplumber.open(BytesIO(file_bytes)) as pdf:
+        total = len(pdf.pages)
+        for i, p in enumerate(pdf.pages, start=1):
+            chunk = _consolidated_rows((p.extract_text() or "").splitlines())
+            p.close()
+            rows += len(chunk)
+            if progress:
+                progress(i, total, rows)
+            if not chunk.empty:
+                yield chunk
+
+def parse_consolidated(file_bytes: bytes, progress: Optional[Callable[[int, int, int], None]] = None,
+                       on_chunk: Optional[Callable[[pd.DataFrame], None]] = None) -> pd.DataFrame:
     """
     Parses a pipe-separated consolidated salary table.
     Returns DataFrame with columns: name, designation, wage_rate, net
+    `on_chunk(page_rows)` sees each page's rows as soon as they are parsed.
     """
-    text = _extract_text(file_bytes)
-    lines = [ln for ln in text.splitlines() if ln.strip().startswith("|") and "|" in ln]
-    rows: List[dict] = []
-    for ln in lines:
-        parts = [p.strip() for p in ln.split("|")]
-        if len(parts) < 10:
-            continue
-        if not parts[1].isdigit():  # SR NO guard
-            continue
+    chunks = []
+    for chunk in iter_consolidated(file_bytes, progress):
+        if on_chunk:
+            on_chunk(chunk)
+        chunks.append(chunk)
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+
+# ---- parse cache ----
+# Keyed on (parser, its PARSER_VERSIONS entry, sha256 of the file), so a PDF that stays
+# uploaded across Streamlit reruns is only run through pdfplumber once.
+
+_parsed: "OrderedDict[tuple, Any]" = OrderedDict()
+_parsed_lock = threading.Lock()
+
+def _disk_path(key: tuple) -> str:
+    kind, version, digest = key
+    return os.path.join(PARSE_CACHE_DIR, f"v{version}", kind, f"{digest}.pkl")
+
+def _cache_key(kind: str, file_bytes: bytes) -> tuple:
+    return (kind, PARSER_VERSIONS[kind], hashlib.sha256(file_bytes).hexdigest())
+
+def _cache_get(key: tuple):
+    with _parsed_lock:
+        if key in _parsed:
+            _parsed.move_to_end(key)
+            return _parsed[key]
+    if PARSE_CACHE_DIR:
         try:
-            name = parts[2]
-            desg = parts[5]
-            wage_rate = float(parts[6].replace(",", "")) if parts[6] else None
-            tail = [p for p in parts[-4:]]  # pick last few numeric cells
-            nums = [float(x.replace(",", "")) for x in tail if re.fullmatch(r"[0-9,\.]+", x)]
-            net = nums[-1] if nums else None
-            rows.append({"name": name, "designation": desg, "wage_rate": wage_rate, "net": net})
-        except Exception:
-            continue
-    return pd.DataFrame(rows)
+            with open(_disk_path(key), "rb") as f:
+                value = pickle.load(f)
+        except (OSError, pickle.PickleError, EOFError):
+            return None
+        _cache_put(key, value, disk=False)
+        return value
+    return None
+
+def _cache_put(key: tuple, value, disk: bool = True) -> None:
+    if disk and PARSE_CACHE_DIR:
+        path = _disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    with _parsed_lock:
+        _parsed[key] = value
+        while len(_parsed) > PARSE_CACHE_SIZE:
+            _parsed.popitem(last=False)
+
+def _cached_parse(kind: str, parse, file_bytes: bytes):
+    key = _cache_key(kind, file_bytes)
+    value = _cache_get(key)
+    if value is None:
+        value = parse(file_bytes)
+        _cache_put(key, value)
+    return value
+
+def parse_payslip_cached(file_bytes: bytes) -> Dict[str, Any]:
+    """parse_payslip through the content-hash cache; returns a copy."""
+    return dict(_cached_parse("payslip", parse_payslip, file_bytes))
+
+def parse_consolidated_cached(file_bytes: bytes, progress=None, on_chunk=None) -> pd.DataFrame:
+    """parse_consolidated through the content-hash cache; callbacks only fire on a miss. Returns a copy."""
+    return _cached_parse("consolidated", lambda b: parse_consolidated(b, progress, on_chunk), file_bytes).copy()
+
+def _parse_job(file_bytes: bytes) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    try:
+        return parse_payslip(file_bytes), None
+    except Exception as e:  # one unreadable file must not sink the batch
+        return None, f"{type(e).__name__}: {e}"
+
+def parse_payslips(blobs: List[bytes], workers: Optional[int] = None, chunksize: int = 4,
+                   progress: Optional[Callable[[int, int], None]] = None
+                   ) -> List[Tuple[Optional[Dict[str, Any]], Optional[str]]]:
+    """
+    parse_payslip over many files: cache hits are served in-process, the rest
+    fan out over a process pool. Returns (parsed, error) per blob in input
+    order; `progress(done, total)` is called as results arrive.
+    """
+    keys = [_cache_key("payslip", b) for b in blobs]
+    out: List[Any] = [None] * len(blobs)
+    todo = []
+    for i, key in enumerate(keys):
+        hit = _cache_get(key)
+        if hit is not None:
+            out[i] = (dict(hit), None)
+        else:
+            todo.append(i)
+    done, total = len(blobs) - len(todo), len(blobs)
+    if progress:
+        progress(done, total)
+
+    workers = workers if workers is not None else (PARSE_WORKERS or os.cpu_count() or 1)
+    workers = min(workers, len(todo))
+    if workers <= 1:
+        results: Iterable = map(_parse_job, (blobs[i] for i in todo))
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        results = pool.map(_parse_job, [blobs[i] for i in todo], chunksize=chunksize)
+    try:
+        for i, (parsed, err) in zip(todo, results):
+            if parsed is not None:
+                _cache_put(keys[i], parsed)
+                parsed = dict(parsed)
+            out[i] = (parsed, err)
+            done += 1
+            if progress:
+                progress(done, total)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return out
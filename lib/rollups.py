@@ -0,0 +1,71 @@
+# lib/rollups.py
+"""
+Pre-aggregated dashboard tables, kept current by the write paths:
+
+  attendance_daily(day, punches)                       <- attendance import
+  payroll_monthly(year, month, payslips, gross, deductions, net)
+                                                       <- payroll run / payslip writes
+
+Write paths add deltas inside their own transaction; rebuild_rollups()
+recomputes both tables from the base tables (backfill / repair):
+
+    python -m lib.rollups
+"""
+from __future__ import annotations
+from .cache import touch
+
+def _p(conn) -> str:
+    return "?" if conn.dialect.name == "sqlite" else "%s"
+
+def add_attendance_days(conn, day_counts) -> None:
+    """Add newly inserted punch counts per day: iterable of (day, n)."""
+    rows = [(d, int(n)) for d, n in day_counts if n]
+    if not rows:
+        return
+    p = _p(conn)
+    conn.exec_driver_sql(
+        f"INSERT INTO attendance_daily(day, punches) VALUES ({p},{p}) "
+        "ON CONFLICT(day) DO UPDATE SET punches = attendance_daily.punches + excluded.punches",
+        rows,
+    )
+
+def add_payslips(conn, year: int, month: int, count: int, gross: float, deductions: float, net: float) -> None:
+    """Add (or, with negative values, remove) payslip totals for one period."""
+    if not (count or gross or deductions or net):
+        return
+    p = _p(conn)
+    conn.exec_driver_sql(
+        f"INSERT INTO payroll_monthly(year, month, payslips, gross, deductions, net) VALUES ({p},{p},{p},{p},{p},{p}) "
+        "ON CONFLICT(year, month) DO UPDATE SET "
+        "payslips = payroll_monthly.payslips + excluded.payslips, "
+        "gross = payroll_monthly.gross + excluded.gross, "
+        "deductions = payroll_monthly.deductions + excluded.deductions, "
+        "net = payroll_monthly.net + excluded.net",
+        (int(year), int(month), int(count), float(gross), float(deductions), float(net)),
+    )
+
+def rebuild_rollups_conn(conn) -> None:
+    conn.exec_driver_sql("DELETE FROM attendance_daily")
+    conn.exec_driver_sql(
+        "INSERT INTO attendance_daily(day, punches) SELECT day, COUNT(*) FROM attendance_logs GROUP BY day"
+    )
+    conn.exec_driver_sql("DELETE FROM payroll_monthly")
+    conn.exec_driver_sql(
+        """
+        INSERT INTO payroll_monthly(year, month, payslips, gross, deductions, net)
+        SELECT pr.year, pr.month, COUNT(*), COALESCE(SUM(p.gross),0), COALESCE(SUM(p.deductions),0), COALESCE(SUM(p.net),0)
+        FROM payslips p JOIN payroll_runs pr ON pr.id = p.run_id
+        GROUP BY pr.year, pr.month
+        """
+    )
+
+def rebuild_rollups(engine) -> None:
+    """Recompute both rollup tables from attendance_logs / payslips in one transaction."""
+    with engine.begin() as conn:
+        rebuild_rollups_conn(conn)
+        touch(conn, "attendance_daily", "payroll_monthly")
+
+if __name__ == "__main__":
+    from .db import engine
+    rebuild_rollups(engine)
+    print("Rollups rebuilt.")
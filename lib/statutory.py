@@ -0,0 +1,117 @@
+# lib/statutory.py
+from __future__ import annotations
+from typing import Optional
+import numpy as np
+import pandas as pd
+
+RULE_COLUMNS = ["component", "kind", "lo", "hi", "value"]
+
+# Seeded into statutory_rules on first run; edit the table, not this list.
+#   rate     -> fraction applied to a wage base
+#   ceiling  -> wage cap (PF) or eligibility limit (ESI)
+#   slab     -> flat amount when lo < gross <= hi (LWF)
+#   band     -> marginal income-tax rate on annual taxable income in (lo, hi]
+#   amount   -> scalar setting (standard deduction, rebate limit)
+DEFAULT_RULES = [
+    ("hra",               "rate",    None,      None,      0.0),  # gross = base salary until HR sets one
+    ("pf",                "ceiling", None,      None,      15000),
+    ("pf_ee",             "rate",    None,      None,      0.12),
+    ("pf_er",             "rate",    None,      None,      0.12),
+    ("admin_pf",          "rate",    None,      None,      0.005),
+    ("esi",               "ceiling", None,      None,      21000),
+    ("esi_ee",            "rate",    None,      None,      0.0075),
+    ("esi_er",            "rate",    None,      None,      0.0325),
+    ("lwf_ee",            "slab",    0,         3000,      6),
+    ("lwf_ee",            "slab",    3000,      None,      12),
+    ("lwf_er",            "slab",    0,         3000,      18),
+    ("lwf_er",            "slab",    3000,      None,      36),
+    ("tds",               "band",    0,         300000,    0.0),
+    ("tds",               "band",    300000,    700000,    0.05),
+    ("tds",               "band",    700000,    1000000,   0.10),
+    ("tds",               "band",    1000000,   1200000,   0.15),
+    ("tds",               "band",    1200000,   1500000,   0.20),
+    ("tds",               "band",    1500000,   None,      0.30),
+    ("tds_cess",          "rate",    None,      None,      0.04),
+    ("tds_std_deduction", "amount",  None,      None,      75000),
+    ("tds_rebate_limit",  "amount",  None,      None,      700000),
+]
+
+COMPONENTS = ["basic", "hra", "gross", "pf_ee", "pf_er", "admin_pf",
+              "esi_ee", "esi_er", "lwf_ee", "lwf_er", "tds", "deductions", "net"]
+
+def default_rules() -> pd.DataFrame:
+    return pd.DataFrame(DEFAULT_RULES, columns=RULE_COLUMNS)
+
+def load_rules(conn) -> pd.DataFrame:
+    """
+    Read the statutory_rules table; falls back to DEFAULT_RULES when empty.
+    """
+    rows = conn.exec_driver_sql(
+        "SELECT component, kind, lo, hi, value FROM statutory_rules"
+    ).fetchall()
+    if not rows:
+        return default_rules()
+    return pd.DataFrame([tuple(r) for r in rows], columns=RULE_COLUMNS)
+
+def _scalar(rules: pd.DataFrame, component: str, kind: str, default: float = 0.0) -> float:
+    hit = rules[(rules["component"] == component) & (rules["kind"] == kind)]
+    return float(hit["value"].iloc[0]) if not hit.empty else default
+
+def _ranges(rules: pd.DataFrame, component: str, kind: str):
+    hit = rules[(rules["component"] == component) & (rules["kind"] == kind)]
+    lo = hit["lo"].fillna(0).astype(float).to_numpy()
+    hi = hit["hi"].fillna(np.inf).astype(float).to_numpy()
+    return lo, hi, hit["value"].astype(float).to_numpy()
+
+def _slab(wage: np.ndarray, rules: pd.DataFrame, component: str) -> np.ndarray:
+    out = np.zeros_like(wage)
+    for lo, hi, v in zip(*_ranges(rules, component, "slab")):
+        out = np.where((wage > lo) & (wage <= hi), v, out)
+    return out
+
+def _annual_tax(taxable: np.ndarray, rules: pd.DataFrame) -> np.ndarray:
+    tax = np.zeros_like(taxable)
+    for lo, hi, rate in zip(*_ranges(rules, "tds", "band")):
+        tax += rate * np.clip(taxable - lo, 0, hi - lo)
+    tax = np.where(taxable <= _scalar(rules, "tds_rebate_limit", "amount"), 0.0, tax)
+    return tax * (1 + _scalar(rules, "tds_cess", "rate"))
+
+def compute_statutory(employees: pd.DataFrame, rules: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """
+    Compute every earning/deduction component for a frame of employees in
+    one vectorized pass. Needs a base_salary column (monthly basic).
+    Returns a copy of the input with the COMPONENTS columns added.
+    """
+    rules = default_rules() if rules is None else rules
+    df = employees.copy()
+    basic = df["base_salary"].astype(float).to_numpy()
+
+    hra = basic * _scalar(rules, "hra", "rate")
+    gross = basic + hra
+
+    pf_wage = np.minimum(basic, _scalar(rules, "pf", "ceiling", np.inf))
+    pf_ee = pf_wage * _scalar(rules, "pf_ee", "rate")
+    pf_er = pf_wage * _scalar(rules, "pf_er", "rate")
+    admin = pf_wage * _scalar(rules, "admin_pf", "rate")
+
+    esi_ok = gross <= _scalar(rules, "esi", "ceiling", np.inf)
+    esi_ee = np.where(esi_ok, gross * _scalar(rules, "esi_ee", "rate"), 0.0)
+    esi_er = np.where(esi_ok, gross * _scalar(rules, "esi_er", "rate"), 0.0)
+
+    lwf_ee = _slab(gross, rules, "lwf_ee")
+    lwf_er = _slab(gross, rules, "lwf_er")
+
+    taxable = np.maximum(gross * 12 - _scalar(rules, "tds_std_deduction", "amount"), 0.0)
+    tds = _annual_tax(taxable, rules) / 12
+
+    cols = {
+        "basic": basic, "hra": hra, "gross": gross,
+        "pf_ee": pf_ee, "pf_er": pf_er, "admin_pf": admin,
+        "esi_ee": esi_ee, "esi_er": esi_er,
+        "lwf_ee": lwf_ee, "lwf_er": lwf_er, "tds": tds,
+    }
+    for k, v in cols.items():
+        df[k] = np.round(v, 2)
+    df["deductions"] = df[["pf_ee", "esi_ee", "lwf_ee", "tds"]].sum(axis=1).round(2)
+    df["net"] = (df["gross"] - df["deductions"]).round(2)
+    return df
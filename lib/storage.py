@@ -1,6 +1,11 @@
+import hashlib
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-from typing import Optional
+from itertools import islice
+from typing import Dict, Iterable, List, Optional, Tuple
 
 # Optional S3/MinIO creds (set in Environment or Streamlit Secrets)
 S3_BUCKET   = os.getenv("S3_BUCKET")
@@ -9,50 +14,260 @@ S3_ENDPOINT = os.getenv("S3_ENDPOINT")  # e.g. MinIO/R2 custom endpoint
 S3_ACCESS   = os.getenv("S3_ACCESS_KEY")
 S3_SECRET   = os.getenv("S3_SECRET_KEY")
 
-def _s3_client():
-    if not (S3_BUCKET and S3_ACCESS and S3_SECRET):
+# Batch upload tuning
+STORAGE_WORKERS     = int(os.getenv("STORAGE_WORKERS", "8"))
+STORAGE_RETRIES     = int(os.getenv("STORAGE_RETRIES", "3"))
+MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD", str(8 * 1024 * 1024)))
+LOCAL_ROOT          = "data"
+
+class LocalStorage:
+    """
+    Filesystem stand-in for S3 with the same interface (ephemeral on Streamlit Cloud).
+    Objects live under ./data/<key>; presign returns None.
+    """
+
+    def __init__(self, root: str = LOCAL_ROOT):
+        self.root = root
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def put(self, key: str, data: bytes, content_type: str = "application/pdf") -> str:
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)  # concurrent writers never expose a half-written file
+        return path
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def presign(self, key: str, expires: int = 3600) -> Optional[str]:
         return None
-    import boto3
-    if S3_ENDPOINT:
-        return boto3.client(
-            "s3",
+
+class S3Storage:
+    """
+    S3/MinIO backend around one shared boto3 client (boto3 clients are thread-safe).
+    Objects at or above MULTIPART_THRESHOLD go through a multipart upload.
+    """
+
+    def __init__(self):
+        import boto3
+        from botocore.config import Config
+        from boto3.s3.transfer import TransferConfig
+
+        kwargs = dict(
             region_name=S3_REGION,
-            endpoint_url=S3_ENDPOINT,
             aws_access_key_id=S3_ACCESS,
             aws_secret_access_key=S3_SECRET,
+            # retries happen once, in _retry (put_many); botocore makes a single attempt
+            config=Config(max_pool_connections=max(10, STORAGE_WORKERS * 2),
+                          retries={"total_max_attempts": 1, "mode": "standard"}),
+        )
+        if S3_ENDPOINT:
+            kwargs["endpoint_url"] = S3_ENDPOINT
+        self.client = boto3.client("s3", **kwargs)
+        self.transfer = TransferConfig(multipart_threshold=MULTIPART_THRESHOLD,
+                                       multipart_chunksize=MULTIPART_THRESHOLD)
+
+    def put(self, key: str, data: bytes, content_type: str = "application/pdf") -> str:
+        extra = {"ACL": "private", "ContentType": content_type}
+        if len(data) >= MULTIPART_THRESHOLD:
+            self.client.upload_fileobj(BytesIO(data), S3_BUCKET, key, ExtraArgs=extra, Config=self.transfer)
+        else:
+            self.client.put_object(Bucket=S3_BUCKET, Key=key, Body=data, **extra)
+        return key
+
+    def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=S3_BUCKET, Key=key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    def presign(self, key: str, expires: int = 3600) -> Optional[str]:
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": S3_BUCKET, "Key": key},
+            ExpiresIn=expires,
         )
-    return boto3.client(
-        "s3",
-        region_name=S3_REGION,
-        aws_access_key_id=S3_ACCESS,
-        aws_secret_access_key=S3_SECRET,
-    )
 
-def put_bytes(key: str, data: bytes) -> str:
+_storage = None
+_storage_lock = threading.Lock()
+
+def get_storage():
+    """Process-wide storage backend: S3Storage if configured, else LocalStorage."""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = S3Storage() if (S3_BUCKET and S3_ACCESS and S3_SECRET) else LocalStorage()
+    return _storage
+
+def _retry(fn, *args, attempts: int = STORAGE_RETRIES, backoff: float = 0.25):
+    for i in range(attempts):
+        try:
+            return fn(*args)
+        except Exception:
+            if i == attempts - 1:
+                raise
+            time.sleep(backoff * 2 ** i)
+
+def put_bytes(key: str, data: bytes, content_type: str = "application/pdf") -> str:
     """
     Upload bytes to S3/MinIO if configured; else write to local ./data storage.
     Returns the object key/path.
     """
-    s3 = _s3_client()
-    if s3:
-        s3.put_object(Bucket=S3_BUCKET, Key=key, Body=data, ACL="private", ContentType="application/pdf")
-        return key
-    # local fallback (ephemeral on Streamlit Cloud)
-    path = os.path.join("data", key)
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "wb") as f:
-        f.write(data)
-    return path
+    return get_storage().put(key, data, content_type)
 
 def presigned_url(key: str, expires: int = 3600) -> Optional[str]:
     """
     Get a temporary URL for S3/MinIO; local fallback returns None.
     """
-    s3 = _s3_client()
-    if not s3:
-        return None
-    return s3.generate_presigned_url(
-        "get_object",
-        Params={"Bucket": S3_BUCKET, "Key": key},
-        ExpiresIn=expires,
-    )
+    return get_storage().presign(key, expires)
+
+def put_many(items: Iterable[Tuple[str, bytes]], content_type: str = "application/pdf",
+             workers: Optional[int] = None, retries: int = STORAGE_RETRIES) -> List[str]:
+    """
+    Upload (key, bytes) pairs concurrently with bounded parallelism and retries.
+    `items` is consumed lazily, so a generator of freshly rendered PDFs starts
+    uploading as soon as the first one is ready; at most 2*workers payloads
+    are held in memory at once. Returns stored keys/paths in input order.
+    """
+    store = get_storage()
+    workers = workers or STORAGE_WORKERS
+    gate = threading.BoundedSemaphore(workers * 2)
+    futures = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for key, data in items:
+            gate.acquire()
+            fut = pool.submit(_retry, store.put, key, data, content_type, attempts=retries)
+            fut.add_done_callback(lambda _: gate.release())
+            futures.append(fut)
+    return [f.result() for f in futures]
+
+def presign_many(keys: Iterable[str], expires: int = 3600) -> List[Optional[str]]:
+    """
+    Presign many keys with the shared client. Signing is local (no round trip),
+    so this is a plain loop; local fallback returns None for each key.
+    """
+    store = get_storage()
+    return [store.presign(k, expires) for k in keys]
+
+# ---- on-demand signing ----
+# payslips.url stores the object key (optionally with a "#page=N" fragment);
+# links are signed when viewed and reused for the first half of their life.
+SIGN_EXPIRES = 3600
+_signed: Dict[str, Tuple[float, str]] = {}
+_signed_lock = threading.Lock()
+
+def signed_urls(keys: Iterable[str], expires: int = SIGN_EXPIRES) -> List[Optional[str]]:
+    """
+    Bulk-sign keys through an in-process TTL cache; only cache misses hit the
+    signer (via presign_many). Local fallback returns None for each key.
+    """
+    keys = list(keys)
+    now = time.time()
+    with _signed_lock:
+        hits = {k: _signed[k][1] for k in set(keys) if k in _signed and _signed[k][0] > now}
+    misses = sorted(set(keys) - hits.keys())
+    if misses:
+        fresh = dict(zip(misses, presign_many(misses, expires)))
+        with _signed_lock:
+            if len(_signed) > 10_000:
+                for k in [k for k, (t, _) in _signed.items() if t <= now]:
+                    del _signed[k]
+            for k, url in fresh.items():
+                if url:
+                    _signed[k] = (now + expires / 2, url)
+        hits.update(fresh)
+    return [hits[k] for k in keys]
+
+def signed_url(key: str, expires: int = SIGN_EXPIRES) -> Optional[str]:
+    return signed_urls([key], expires)[0]
+
+def object_urls(refs: Iterable[Optional[str]]) -> List[Optional[str]]:
+    """
+    Resolve stored payslip refs to viewable links: signed URL on S3, local path
+    otherwise. Older rows that already hold a URL or local path pass through.
+    """
+    refs = list(refs)
+    keyed = [i for i, r in enumerate(refs) if r and not r.startswith(("http://", "https://", LOCAL_ROOT + os.sep))]
+    split = [refs[i].partition("#") for i in keyed]
+    urls = signed_urls([key for key, _, _ in split])
+    out = list(refs)
+    for i, (key, sep, frag), url in zip(keyed, split, urls):
+        out[i] = (url or os.path.join(LOCAL_ROOT, key)) + sep + frag
+    return out
+
+def object_url(ref: Optional[str]) -> Optional[str]:
+    return object_urls([ref])[0]
+
+# ---- content-addressed dedupe ----
+# Bytes are stored once under cas/<aa>/<sha256><ext>; object_manifest maps each
+# logical key (e.g. 2025/03/payslip_E001.pdf) to the digest it currently holds.
+
+def blob_key(digest: str, ext: str = ".pdf") -> str:
+    return f"cas/{digest[:2]}/{digest}{ext}"
+
+def _known_digests(engine, digests) -> set:
+    if not digests:
+        return set()
+    p = "?" if engine.dialect.name == "sqlite" else "%s"
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql(
+            f"SELECT DISTINCT digest FROM object_manifest WHERE digest IN ({','.join([p] * len(digests))})",
+            tuple(digests),
+        ).fetchall()
+    return {r[0] for r in rows}
+
+def _present(keys) -> set:
+    # S3 is durable, so its manifest is trusted as is; local storage is wiped on
+    # restart (Streamlit Cloud), so a known digest only counts if its file is still there
+    store = get_storage()
+    if not isinstance(store, LocalStorage):
+        return set(keys)
+    return {k for k in set(keys) if store.exists(k)}
+
+def put_deduped(engine, items: Iterable[Tuple[str, bytes]], content_type: str = "application/pdf",
+                workers: Optional[int] = None, chunk: int = 256) -> Tuple[List[str], List[bool]]:
+    """
+    Content-addressed put_many: hash each payload and upload only blobs that
+    are not stored yet. A digest already in the manifest is reused (on local
+    storage only if its blob file still exists; otherwise it is uploaded
+    again). `items` (logical key, bytes) is consumed lazily in chunks.
+    Returns (blob keys, reused flags) in input order; reused=True means the
+    upload was skipped. The manifest is updated in one bulk upsert per chunk.
+    """
+    from .db import bulk_insert
+
+    blob_keys, reused = [], []
+    it = iter(items)
+    while True:
+        batch = list(islice(it, chunk))
+        if not batch:
+            break
+        digests = [hashlib.sha256(data).hexdigest() for _, data in batch]
+        known = _known_digests(engine, set(digests))
+        bks = [blob_key(dg, os.path.splitext(key)[1]) for (key, _), dg in zip(batch, digests)]
+        present = _present([bk for bk, dg in zip(bks, digests) if dg in known])
+        todo = {}
+        for (key, data), bk in zip(batch, bks):
+            hit = bk in present or bk in todo
+            if not hit:
+                todo[bk] = data
+            blob_keys.append(bk)
+            reused.append(hit)
+        put_many(todo.items(), content_type, workers)
+        with engine.begin() as conn:
+            bulk_insert(
+                conn, "object_manifest", ("key", "digest", "size"),
+                list({key: (key, dg, len(data)) for (key, data), dg in zip(batch, digests)}.values()),
+                suffix="ON CONFLICT(key) DO UPDATE SET digest=excluded.digest, size=excluded.size",
+            )
+    return blob_keys, reused
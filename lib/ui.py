@@ -1,6 +1,7 @@
 # lib/ui.py
 from __future__ import annotations
 import base64
+from functools import lru_cache
 from typing import Dict
 
 import altair as alt
@@ -32,6 +33,7 @@ def get_theme() -> Dict[str, str]:
     return PALETTE_LIGHT if mode == "light" else PALETTE_DARK
 
 
+@lru_cache(maxsize=8)
 def _img_to_base64(path: str) -> str:
     try:
         with open(path, "rb") as f:
@@ -40,8 +42,10 @@ def _img_to_base64(path: str) -> str:
         return ""
 
 
-def inject_theme_css(theme: Dict[str, str]) -> None:
-    css = f"""
+@lru_cache(maxsize=4)
+def _theme_css(mode: str) -> str:
+    theme = PALETTE_LIGHT if mode == "light" else PALETTE_DARK
+    return f"""
     <style>
       :root {{
         --hrms-primary: {theme['primary']};
@@ -99,8 +103,18 @@ def inject_theme_css(theme: Dict[str, str]) -> None:
       .stTabs [data-baseweb="tab"] {{ font-weight:600; }}
     </style>
     """
-    st.markdown(css, unsafe_allow_html=True)
-    alt.themes.enable("none")
+
+
+_alt_theme_set = False
+
+
+def inject_theme_css(theme: Dict[str, str]) -> None:
+    """Emit the theme CSS (built once per palette) and set the Altair theme once per process."""
+    global _alt_theme_set
+    st.markdown(_theme_css(theme["mode"]), unsafe_allow_html=True)
+    if not _alt_theme_set:
+        alt.themes.enable("none")
+        _alt_theme_set = True
 
 
 def top_nav(active_key: str, username: str, app_name: str = "INET HRMS",
@@ -187,3 +201,28 @@ def chart_card(title: str, chart) -> None:
     """
     st.subheader(title)
     st.altair_chart(chart, use_container_width=True)
+
+
+@st.fragment(run_every=2)
+def job_panel(engine, kinds, key: str) -> None:
+    """
+    Recent background jobs of `kinds`, re-polled every 2 s without rerunning
+    the page; active jobs can be cancelled from here.
+    """
+    import pandas as pd
+    from lib.jobs import ACTIVE, cancel, list_jobs
+
+    jobs = list_jobs(engine, kinds, limit=10)
+    if not jobs:
+        st.caption("No jobs yet.")
+        return
+    df = pd.DataFrame(jobs)[["id", "kind", "status", "progress", "message", "error", "created_at", "finished_at"]]
+    df["error"] = df["error"].str.split("\n").str[0]
+    st.dataframe(df, use_container_width=True, hide_index=True,
+                 column_config={"progress": st.column_config.ProgressColumn("Progress", min_value=0, max_value=1)})
+    active = [j["id"] for j in jobs if j["status"] in ACTIVE]
+    if active:
+        c1, c2 = st.columns([3, 1])
+        pick = c1.selectbox("Active job", active, key=f"{key}_cancel_pick", label_visibility="collapsed")
+        if c2.button("Cancel job", key=f"{key}_cancel"):
+            cancel(engine, int(pick))